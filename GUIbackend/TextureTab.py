@@ -1,3 +1,4 @@
+import struct
 import tkinter
 from tkinter import messagebox
 from tkinter import ttk
@@ -7,19 +8,16 @@ import PIL.Image
 from PIL import ImageTk
 
 from GUIbackend.file_helpers import *
-from bmp_png_conversion import BMPtoPNG, PNGtoBMP
+from bmp_png_conversion import BMPtoPNG, PNGtoBMP, SubtextureToPNG
 from texture_tool import *
 
-import multiprocessing
-
-png_converter_pool = multiprocessing.Pool()
-
 
 class TextureTab:
     def __init__(self, tab_control):
         self.texture_tab = ttk.Frame(tab_control)
         tab_control.add(self.texture_tab, text='Texture Tab')
 
+        # Filled on first use, None until a sub-texture is shown or exported
         self.bmp_texture_list = []  # For conversion and export
         self.png_texture_list = []  # For export and preview
 
@@ -64,6 +62,12 @@ class TextureTab:
         self.open_input_texture_button = Button(self.input_frame, text="Select", command=self.open_texture_file)
         self.open_input_texture_button.grid(column=2, row=0)
 
+        # RTXR compression isn't documented, so decoding it is opt-in (see RTXR.yakuza_decoding)
+        self.rtxr_yakuza_decoding = BooleanVar(value=False)
+        self.rtxr_yakuza_decoding_checkbutton = Checkbutton(self.input_frame, text="Try RTXR decoding",
+                                                            variable=self.rtxr_yakuza_decoding)
+        self.rtxr_yakuza_decoding_checkbutton.grid(column=3, row=0)
+
     # Left Panel
     def setup_texture_info_box(self, parent_frame):
         self.texture_info_box_frame = ttk.Frame(parent_frame)
@@ -214,6 +218,10 @@ class TextureTab:
             tkinter.messagebox.showwarning(title="Warning", message="MTEX textures can't be edited through GUI.")
             return
 
+        if self.unpacked_texture.file_header["Signature"] == b"RTXR":
+            tkinter.messagebox.showwarning(title="Warning", message="RTXR textures can't be edited through GUI.")
+            return
+
         image_path = filedialog.askopenfilename(filetypes=sr2_file_types["Images"])
 
         if image_path == "":
@@ -260,13 +268,27 @@ class TextureTab:
         # Easy to implement but useless without add_subtexture_at_id
         #
 
+    def get_subtexture_png(self, sub_texture_index):
+        # Only this sub-texture gets decoded, straight from the texture header without a BMP in between
+        if self.png_texture_list[sub_texture_index] is None:
+            self.png_texture_list[sub_texture_index] = SubtextureToPNG(self.unpacked_texture, sub_texture_index)
+        return self.png_texture_list[sub_texture_index]
+
+    def get_subtexture_bmp(self, sub_texture_index):
+        if self.bmp_texture_list[sub_texture_index] is None:
+            bmp = self.unpacked_texture.setup_bmp(sub_texture_index)
+            bmp.pixel_bytes = self.unpacked_texture.pixel_bytes_list[sub_texture_index]
+            self.bmp_texture_list[sub_texture_index] = bmp
+        return self.bmp_texture_list[sub_texture_index]
+
     def update_texture_preview(self, sub_texture_index):
+        # Sub-textures that don't decode (like RTXR) only fail once they're shown
         try:
-             self.png_texture_list = self.pool_png_result.get(2)
-        except:
-            pass
-
-        image_preview = self.png_texture_list[sub_texture_index].copy()
+            image_preview = self.get_subtexture_png(sub_texture_index).copy()
+        except ValueError as error:
+            self.image_canvas.itemconfig(self.image_container, image=self.empty_image)
+            tkinter.messagebox.showerror(title="Error", message=str(error))
+            return
         image_preview.thumbnail((512, 512))
 
         new_display_image = ImageTk.PhotoImage(image_preview)
@@ -285,25 +307,22 @@ class TextureTab:
         if texture_path != "":
             self.input_texture_file_title = texture_path[texture_path.rfind("/") + 1:]
 
-            self.unpacked_texture = detect_texture_type(texture_path)
-            self.unpacked_texture.unpack_from_file(texture_path)
-
-            with open(texture_path, 'r+b') as f:
-                file_signature = f.read(4)
+            self.unpacked_texture = detect_texture_type(texture_path, self.rtxr_yakuza_decoding.get())
+            # Only the headers are read here, sub-textures are decoded one by one when they're shown or exported
+            self.unpacked_texture.lazy_unpacking = True
 
-                if file_signature == b'RTXR':
-                    tkinter.messagebox.showerror(title="Error", message="Can't open RTXR textures.")
-                    return
+            try:
+                self.unpacked_texture.unpack_from_file(texture_path)
+            except (ValueError, struct.error) as error:
+                # Not a texture or a cut off file
+                tkinter.messagebox.showerror(title="Error", message=str(error))
+                return
 
-            # Convert subtextures into BMP and PNG for export and preview
-            self.bmp_texture_list = convertTXRtoBMPlist(texture_path)
-            self.png_texture_list = [self.empty_image for i in range(len(self.bmp_texture_list))]
+            subtexture_count = len(self.unpacked_texture.texture_header_list)
+            self.bmp_texture_list = [None] * subtexture_count
+            self.png_texture_list = [None] * subtexture_count
 
-            # Run proper PNG conversion in async mode for even more speed
-            self.pool_png_result = png_converter_pool.map_async(BMPtoPNG, self.bmp_texture_list)
-            # Thought you still need to wait if you want previews
-
-            self.update_id_list(len(self.unpacked_texture.pixel_bytes_list))
+            self.update_id_list(subtexture_count)
             self.texture_id_listbox.configure(listvariable=self.id_list_var)
 
             self.update_texture_info(0)
@@ -343,7 +362,8 @@ class TextureTab:
 
         self.texture_info_labels["Value"][3]["text"] = color_format_string
         self.texture_info_labels["Value"][4]["text"] = 0  # Subtexture offset
-        self.texture_info_labels["Value"][5]["text"] = len(self.unpacked_texture.pixel_bytes_list[texture_index])
+        # Stored size from the header, so showing the info doesn't decode anything
+        self.texture_info_labels["Value"][5]["text"] = current_texture_header["Image Size (in bytes)"]
 
     def export_texture(self):
         # print(self.export_image_format.get())
@@ -352,17 +372,18 @@ class TextureTab:
         if self.output_folder == "/":
             return
 
-        subtexture_index_counter = 0
-        if self.export_image_format.get() == "png":
-            self.pool_png_result.wait()
-            self.png_texture_list = self.pool_png_result.get()
-            for png in self.png_texture_list:
-                png.save(self.output_folder + self.input_texture_file_title + "." + str(subtexture_index_counter) + ".png")
-                subtexture_index_counter += 1
-        elif self.export_image_format.get() == "bmp":
-            for bmp in self.bmp_texture_list:
-                bmp.save(self.output_folder + self.input_texture_file_title + "." + str(subtexture_index_counter) + ".bmp")
-                subtexture_index_counter += 1
+        try:
+            if self.export_image_format.get() == "png":
+                for subtexture_index_counter in range(len(self.png_texture_list)):
+                    png = self.get_subtexture_png(subtexture_index_counter)
+                    png.save(self.output_folder + self.input_texture_file_title + "." + str(subtexture_index_counter) + ".png")
+            elif self.export_image_format.get() == "bmp":
+                for subtexture_index_counter in range(len(self.bmp_texture_list)):
+                    bmp = self.get_subtexture_bmp(subtexture_index_counter)
+                    bmp.save(self.output_folder + self.input_texture_file_title + "." + str(subtexture_index_counter) + ".bmp")
+        except ValueError as error:
+            tkinter.messagebox.showerror(title="Error", message=str(error))
+            return
 
         tkinter.messagebox.showinfo(title="Success", message="Successfully extracted to", detail=self.output_folder)
 
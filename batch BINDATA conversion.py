@@ -1,44 +1,172 @@
+import argparse
 import os.path
 from texture_tool import *
+from rebuild_cache import RebuildManifest
+from file_index import FileIndex, texture_file_types
 
+# Kept in the output folders, the packer only picks up images so it doesn't mind them
+UNPACK_MANIFEST_NAME = "unpack_manifest.json"
+PACK_MANIFEST_NAME = "pack_manifest.json"
+BINDATA_INDEX_NAME = "bindata_index.json"
 
-def unpackBINDATAtextures(bindata_folder, bindata_output_folder, png_export=False):
-    file_list = []
-    # Scan all included folders
-    for path, subdirs, files in os.walk(bindata_folder):
-        for name in files:
-            file_list.append(os.path.join(path, name))
-            # print(os.path.join(path, name))
+
+def indexBINDATAfiles(bindata_folder, bindata_output_folder) -> FileIndex:
+    """
+    Brings the file type index of bindata_folder (kept in bindata_output_folder) up to date
+    Only new and changed files are opened, and only their first 16 bytes are read
+    """
+    file_index = FileIndex(os.path.join(bindata_output_folder, BINDATA_INDEX_NAME))
+    file_index.scan(bindata_folder)
+    file_index.save()
+    return file_index
+
+
+def unpackBINDATAtextures(bindata_folder, bindata_output_folder, png_export=False,
+                          png_preset="default", worker_count=None, force=False, deduplicate=False,
+                          png_compress_level=None, png_optimize=None, rtxr_yakuza_decoding=False):
+    """
+    png_preset: "default", "fast" (iteration builds) or "small" (release packaging),
+    png_compress_level (0-9) and png_optimize override it
+    Textures are converted by worker_count processes (all CPU cores if None), 1 keeps everything in this process
+    Textures that didn't change since the last unpack are skipped, force=True exports everything again
+    deduplicate=True exports repeated textures once and hardlinks the copies (see batchConvertTXRtoBMP),
+    off by default so every exported image can be edited on its own
+    rtxr_yakuza_decoding=True tries Yakuza LZ on RTXR textures, which are skipped otherwise
+    """
+    # Only textures are handed to the converter, everything else is left unopened
+    file_index = indexBINDATAfiles(bindata_folder, bindata_output_folder)
+    file_list = file_index.query(texture_file_types, bindata_folder)
+
+    rebuild_manifest = RebuildManifest(os.path.join(bindata_output_folder, UNPACK_MANIFEST_NAME), force)
+    # Textures deleted from BINDATA take their exported images with them
+    rebuild_manifest.prune(file_list)
 
     # Convert all texture files and save at a different folder
-    for file_path in file_list:
-        if os.path.isfile(file_path):
-            # print(file_path)
-            convertTXRtoBMP(file_path, bindata_output_folder, png_export)
+    try:
+        batchConvertTXRtoBMP(file_list, bindata_output_folder, png_export, png_preset, worker_count,
+                             rebuild_manifest=rebuild_manifest, deduplicate=deduplicate,
+                             png_compress_level=png_compress_level, png_optimize=png_optimize,
+                             rtxr_yakuza_decoding=rtxr_yakuza_decoding)
+    finally:
+        rebuild_manifest.save()
+
+
+def get_unpacked_source_textures(unpacked_bindata_folder, texture_group_list) -> dict:
+    """
+    Maps texture groups to the BINDATA textures they were unpacked from, per the manifest unpackBINDATAtextures left
+    Textures with the same name in different folders are told apart by their full path,
+    groups with images from more than one texture or with no unpacked images aren't mapped
+    """
+    unpack_manifest = RebuildManifest(os.path.join(unpacked_bindata_folder, UNPACK_MANIFEST_NAME))
+    image_source_dict = {}
+    for texture_path, manifest_entry in unpack_manifest.entry_dict.items():
+        for image_path in manifest_entry["Outputs"]:
+            image_source_dict.setdefault(os.path.normpath(image_path), set()).add(texture_path)
+
+    source_texture_dict = {}
+    for bmp_group, image_path_list, _ in texture_group_list:
+        source_texture_set = set()
+        for image_path in image_path_list:
+            source_texture_set |= image_source_dict.get(os.path.normpath(image_path), set())
+
+        if len(source_texture_set) == 1:
+            source_texture_dict[bmp_group] = source_texture_set.pop()
+        elif len(source_texture_set) > 1:
+            print("{} was unpacked from more than one texture ({}), packing it with the default format".format(
+                bmp_group, ", ".join(sorted(source_texture_set))))
 
+    return source_texture_dict
 
-def packBINDATAtextures(unpacked_bindata_folder, pack_textures_to_folder, png_input=False):
+
+def packBINDATAtextures(unpacked_bindata_folder, pack_textures_to_folder, png_input=False, worker_count=None,
+                        force=False):
+    """
+    Texture groups of all folders are packed together by worker_count processes
+    (all CPU cores if None, 1 keeps everything in this process), timings are returned per texture
+    Only textures with added, removed or edited images are packed again, force=True packs everything
+    Textures unpacked from MTEX files (per the manifest and file index unpackBINDATAtextures left)
+    are packed as MTEX again
+    """
     folder_list = []
 
     for path, subdirs, files in os.walk(unpacked_bindata_folder):
         folder_list.append(path)
         # print(path)
 
+    texture_group_list = []
+
     for input_folder in folder_list:
         output_folder = input_folder.replace(unpacked_bindata_folder, pack_textures_to_folder)
         # print(output_folder)
         os.makedirs(os.path.dirname(output_folder), exist_ok=True)
-        convertBMPtoTXR(input_folder + '/', output_folder + '/', png_input)
+        texture_group_list += collectTextureGroups(input_folder + '/', output_folder + '/', png_input)
+
+    # The index of the original files tells the types of the textures the groups were unpacked from
+    file_index = FileIndex(os.path.join(unpacked_bindata_folder, BINDATA_INDEX_NAME))
+    # MTEX sub-textures keep their color format, twiddling and compression from the original file
+    source_texture_dict = {bmp_group: source_texture_path
+                           for bmp_group, source_texture_path
+                           in get_unpacked_source_textures(unpacked_bindata_folder, texture_group_list).items()
+                           if file_index.get_type(source_texture_path) == "MTEX"}
+    texture_format_dict = {bmp_group: "MTEX" for bmp_group in source_texture_dict}
+
+    rebuild_manifest = RebuildManifest(os.path.join(pack_textures_to_folder, PACK_MANIFEST_NAME), force)
+    rebuild_manifest.prune([output_texture_path for _, _, output_texture_path in texture_group_list])
+
+    try:
+        return packTextureGroups(texture_group_list, png_input, worker_count, rebuild_manifest, texture_format_dict,
+                                 source_texture_dict)
+    finally:
+        rebuild_manifest.save()
+
+
+# Worker processes import this file again, so only run conversions from here
+if __name__ == "__main__":
+    # Unpack all texture from the entire game directory and put them at bindata_output_folder (with folders)
+    # To unpack as PNG change png_export=False to png_export=True
+    # png_preset="fast" encodes PNGs much faster with bigger files, png_preset="small" is for release packaging
+    bindata_folder = "./BINDATA/"
+    bindata_output_folder = "./Extracted BINDATA bmp/"
+    # unpackBINDATAtextures(bindata_folder, bindata_output_folder, png_export=False, force=False)
 
+    # Repack extracted textures
+    # To pack PNGs instead of BMPs change png_input=False to png_input=True
+    unpacked_bindata_folder = "./Extracted BINDATA bmp/"
+    pack_textures_to_folder = "./Packed BINDATA bmp/"
+    # packBINDATAtextures(unpacked_bindata_folder, pack_textures_to_folder, png_input=False, force=False)
 
-# Unpack all texture from the entire game directory and put them at bindata_output_folder (with folders)
-# To unpack as PNG change png_export=False to png_export=True
-bindata_folder = "./BINDATA/"
-bindata_output_folder = "./Extracted BINDATA bmp/"
-# unpackBINDATAtextures(bindata_folder, bindata_output_folder, png_export=False)
+    # Or run "batch BINDATA conversion.py" unpack/pack/index [--png] [--force] [--preset fast] [--workers 4] [--dedup]
+    # with the folders above
+    # index only updates the file type index and prints how many files of each type there are
+    argument_parser = argparse.ArgumentParser(description="Unpack or repack all BINDATA textures")
+    argument_parser.add_argument("command", nargs="?", choices=("unpack", "pack", "index"))
+    argument_parser.add_argument("--png", action="store_true", help="export/pack PNGs instead of BMPs")
+    argument_parser.add_argument("--force", action="store_true", help="rebuild unchanged textures too")
+    argument_parser.add_argument("--workers", type=int, default=None,
+                                 help="number of processes, all CPU cores by default, 1 - no process pool")
+    argument_parser.add_argument("--preset", choices=tuple(bmp_png_conversion.png_save_presets), default="default",
+                                 help="PNG export preset")
+    argument_parser.add_argument("--compress-level", type=int, choices=range(10), default=None, metavar="0-9",
+                                 help="PNG compression level, overrides the preset")
+    argument_parser.add_argument("--optimize", action=argparse.BooleanOptionalAction, default=None,
+                                 help="PNG optimize flag, overrides the preset")
+    argument_parser.add_argument("--dedup", action="store_true",
+                                 help="unpack repeated textures once and hardlink the copies, "
+                                      "editing one copy in place edits all of them")
+    argument_parser.add_argument("--rtxr-yakuza", action="store_true",
+                                 help="try Yakuza LZ decoding on RTXR textures instead of skipping them, "
+                                      "only streams that decode exactly are accepted")
+    arguments = argument_parser.parse_args()
 
-# Repack extracted textures
-# To pack PNGs instead of BMPs change png_input=False to png_input=True
-unpacked_bindata_folder = "./Extracted BINDATA bmp/"
-pack_textures_to_folder = "./Packed BINDATA bmp/"
-# packBINDATAtextures(unpacked_bindata_folder, pack_textures_to_folder, png_input=False)
+    if arguments.command == "unpack":
+        unpackBINDATAtextures(bindata_folder, bindata_output_folder, png_export=arguments.png,
+                              png_preset=arguments.preset, worker_count=arguments.workers, force=arguments.force,
+                              deduplicate=arguments.dedup, png_compress_level=arguments.compress_level,
+                              png_optimize=arguments.optimize, rtxr_yakuza_decoding=arguments.rtxr_yakuza)
+    elif arguments.command == "pack":
+        packBINDATAtextures(unpacked_bindata_folder, pack_textures_to_folder, png_input=arguments.png,
+                            worker_count=arguments.workers, force=arguments.force)
+    elif arguments.command == "index":
+        for file_type, file_count in sorted(indexBINDATAfiles(bindata_folder,
+                                                              bindata_output_folder).get_type_counts().items()):
+            print("{}: {}".format(file_type, file_count))
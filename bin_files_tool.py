@@ -61,11 +61,16 @@ class BIN:
     def split_RTEX(self, bin_file_bytes):
         bin_file_size = len(bin_file_bytes)
 
+        # Slicing a memoryview doesn't copy the rest of the file for every texture
+        bin_file_view = memoryview(bin_file_bytes)
+
         texture_file_offset = 0x0
         while texture_file_offset < bin_file_size:
             # Unpack function won't read past the correct size
+            # Only headers are needed here, so pixel bytes are left alone
             texture = texture_classes.RTEX()
-            texture.unpack_from_bytes(bin_file_bytes[texture_file_offset:])
+            texture.lazy_unpacking = True
+            texture.unpack_from_bytes(bin_file_view[texture_file_offset:])
 
             full_texture_file_size = 0x1000  # Full header size
             for texture_header in texture.texture_header_list:
@@ -4,6 +4,8 @@ V5 BMP specifically (created by GIMP), since it supports transparency.
 """
 import struct
 
+import numpy
+
 BITMAPFILEHEADER = {
     "Signature": b'BM',
     "File Size": 0,  # image_size + header_size
@@ -49,6 +51,11 @@ def fill_dict_from_bytes_by_formatting(dictionary: dict, source_bytes: bytes, fo
     return dictionary
 
 
+def get_row_stride(image_width, bpp) -> int:
+    # BMP rows are padded to 4 bytes
+    return ((image_width * bpp + 31) // 32) * 4
+
+
 class BMPv5:
     def __init__(self):
         # Header structure
@@ -103,17 +110,59 @@ class BMPv5:
             else:
                 return "Other"
 
+    def get_row_byte_size(self) -> int:
+        return (self.image_header["Image Width"] * self.image_header["BPP"] + 7) // 8
+
+    def get_row_stride(self) -> int:
+        return get_row_stride(self.image_header["Image Width"], self.image_header["BPP"])
+
+    def rows_need_padding(self) -> bool:
+        # pixel_bytes are kept without row padding, it's only added when the file is written
+        row_count = abs(self.image_header["Image Height"])
+        return (self.get_row_stride() != self.get_row_byte_size()
+                and len(self.pixel_bytes) == self.get_row_byte_size() * row_count)
+
+    def get_pixel_row_array(self) -> numpy.array:
+        """
+        (rows, row bytes) uint8 view of pixel_bytes in stored row order, padding is skipped
+        Works on both unpadded and padded pixel bytes
+        """
+        row_count = abs(self.image_header["Image Height"])
+        row_byte_size = self.get_row_byte_size()
+
+        pixel_byte_array = numpy.frombuffer(self.pixel_bytes, dtype=numpy.uint8)
+        if len(pixel_byte_array) >= self.get_row_stride() * row_count and row_count > 0:
+            pixel_byte_array = pixel_byte_array[:self.get_row_stride() * row_count].reshape(row_count, -1)
+            return pixel_byte_array[:, :row_byte_size]
+
+        return pixel_byte_array[:row_byte_size * row_count].reshape(row_count, row_byte_size)
+
+    def get_padded_pixel_bytes(self):
+        if not self.rows_need_padding():
+            return self.pixel_bytes
+
+        row_count = abs(self.image_header["Image Height"])
+        padded_pixel_byte_array = numpy.zeros((row_count, self.get_row_stride()), dtype=numpy.uint8)
+        padded_pixel_byte_array[:, :self.get_row_byte_size()] = self.get_pixel_row_array()
+
+        return padded_pixel_byte_array.data
+
+    def get_padded_pixel_byte_count(self) -> int:
+        if self.rows_need_padding():
+            return self.get_row_stride() * abs(self.image_header["Image Height"])
+        return len(self.pixel_bytes)
+
     def update_file_size_and_pixel_offset(self):
         self.file_header["File Size"] = (self.FILE_HEADER_SIZE
                                          + self.IMAGE_HEADER_SIZE
                                          + len(self.color_table_bytes)
-                                         + len(self.pixel_bytes))
+                                         + self.get_padded_pixel_byte_count())
 
         self.file_header["Offset to PixelArray"] = (self.FILE_HEADER_SIZE
                                                     + self.IMAGE_HEADER_SIZE
                                                     + len(self.color_table_bytes))
 
-        self.image_header["Image Size"] = len(self.pixel_bytes)
+        self.image_header["Image Size"] = self.get_padded_pixel_byte_count()
 
     def swapColorFormat(self, color_format):
         if color_format == "RGB565":
@@ -135,6 +184,8 @@ class BMPv5:
             raise ValueError("Incorrect BMP Color Format")
 
     def unpack_from_bytes(self, bitmap_bytes):
+        # Slices of a memoryview don't copy the pixels
+        bitmap_bytes = memoryview(bitmap_bytes)
 
         self.file_header = fill_dict_from_bytes_by_formatting(self.file_header,
                                                           bitmap_bytes[:self.FILE_HEADER_SIZE],
@@ -144,29 +195,41 @@ class BMPv5:
                                                            bitmap_bytes[self.FILE_HEADER_SIZE:self.FILE_HEADER_SIZE + self.IMAGE_HEADER_SIZE],
                                                                self.BMP_IMAGE_HEADER_FORMATTING)
 
-        # Read palette if present
+        # Read palette if present, kept as bytes since palettes get compared and looked up
         if self.file_header["Offset to PixelArray"] - (self.FILE_HEADER_SIZE + self.IMAGE_HEADER_SIZE) > 0:
-            self.color_table_bytes = bitmap_bytes[self.FILE_HEADER_SIZE + self.IMAGE_HEADER_SIZE:self.file_header["Offset to PixelArray"]]
+            self.color_table_bytes = bytes(bitmap_bytes[self.FILE_HEADER_SIZE + self.IMAGE_HEADER_SIZE:self.file_header["Offset to PixelArray"]])
 
         self.pixel_bytes = bitmap_bytes[self.file_header["Offset to PixelArray"]:]
 
+        # Textures don't have row padding, so it's dropped here (the only case that copies)
+        row_count = abs(self.image_header["Image Height"])
+        padded_pixel_byte_count = self.get_row_stride() * row_count
+
+        if (self.image_header["Compression"] in (0, 3) and row_count > 0
+                and len(self.pixel_bytes) >= padded_pixel_byte_count):
+            if self.get_row_stride() != self.get_row_byte_size():
+                self.pixel_bytes = self.get_pixel_row_array().tobytes()
+            else:
+                self.pixel_bytes = self.pixel_bytes[:padded_pixel_byte_count]
+
     def unpack_from_file(self, bitmap_path: str):
         bitmap_file = open(bitmap_path, "r+b")
         bitmap_bytes = bitmap_file.read()
         self.unpack_from_bytes(bitmap_bytes)
         bitmap_file.close()
 
-    def pack_and_return(self):
+    def pack_buffer_list(self) -> list:
+        # Headers, color table and pixels as separate buffers, nothing is concatenated
         self.update_file_size_and_pixel_offset()
 
         file_header_bytes = struct.pack(self.BMP_FILE_HEADER_FORMATTING, *list(self.file_header.values()))
         image_header_bytes = struct.pack(self.BMP_IMAGE_HEADER_FORMATTING, *list(self.image_header.values()))
 
-        return file_header_bytes + image_header_bytes + self.color_table_bytes + self.pixel_bytes
+        return [file_header_bytes, image_header_bytes, self.color_table_bytes, self.get_padded_pixel_bytes()]
 
-    def save(self, output_path):
-        bin_data = self.pack_and_return()
+    def pack_and_return(self):
+        return b''.join(self.pack_buffer_list())
 
-        output_file = open(output_path, "w+b")
-        output_file.write(bin_data)
-        output_file.close()
+    def save(self, output_path):
+        with open(output_path, "w+b") as output_file:
+            output_file.writelines(self.pack_buffer_list())
@@ -6,108 +6,224 @@ import color_conversion
 from bmp_handler import BMPv5
 
 
-def BMPtoPNG(unpacked_bmp: BMPv5) -> Image:
+def BMPtoPNG(unpacked_bmp: BMPv5, buffer_pool=None) -> Image:
     """
     Unpack BMP image using BMP class
     Convert 16-bit pixel bytes into RGBA8888 array
     Turn the array into PIL Image
+    With buffer_pool the Image shares its pixels with a pooled buffer, save it before the next conversion
     """
     bmp_bpp = unpacked_bmp.image_header["BPP"]
     bmp_color_format = unpacked_bmp.check_color_format()
     bmp_pixel_bytes = unpacked_bmp.pixel_bytes
 
+    width = unpacked_bmp.image_header["Image Width"]
+    height = unpacked_bmp.image_header["Image Height"]
+
     png_pixel_array = []
 
     if len(unpacked_bmp.color_table_bytes) > 0:
-        color_palette_bytes = unpacked_bmp.color_table_bytes
-        color_palette_array = numpy.frombuffer(color_palette_bytes, dtype=numpy.uint8)
-        color_palette_array = color_palette_array.reshape(1, 256, 4).copy()
+        color_palette_array = color_conversion.convertColorTableToRGBA8888(unpacked_bmp.color_table_bytes,
+                                                                           bmp_color_format)
 
-        for color_array_index in range(len(color_palette_array[0])):
-            R = color_palette_array[0, color_array_index, 2]
-            G = color_palette_array[0, color_array_index, 1]
-            B = color_palette_array[0, color_array_index, 0]
+        output_buffer = None
+        if buffer_pool is not None:
+            output_buffer = buffer_pool.get_buffer((abs(height), width, 4))
 
-            color_palette_array[0, color_array_index, 0] = R
-            color_palette_array[0, color_array_index, 1] = G
-            color_palette_array[0, color_array_index, 2] = B
-            color_palette_array[0, color_array_index, 3] = 255
+        # One gather through the palette, rows are read in top-down order
+        color_index_array = numpy.frombuffer(bmp_pixel_bytes, dtype=numpy.uint8, count=width * abs(height))
+        color_index_array = color_index_array.reshape(abs(height), width)
+        if get_bmp_row_orientation(height) == "bottom-up":
+            color_index_array = color_index_array[::-1]
 
-        if bmp_color_format == "ARGB1555":
-            color_palette_array[0, 0, 3] = 0  # First color is transparent
+        png_pixel_array = color_palette_array.take(color_index_array, axis=0, out=output_buffer)
+        return Image.fromarray(png_pixel_array)
+    else:
+        if bmp_bpp == 16:
+            if bmp_color_format in ("RGB565", "ARGB1555", "ARGB4444"):
+                output_buffer = None
+                if buffer_pool is not None:
+                    output_buffer = buffer_pool.get_buffer((abs(height), width, 4))
 
-        # print(color_palette_array)
+                # Colors and row order in one pass, the array comes out top-down
+                png_pixel_array = color_conversion.transcode_pixels(bmp_pixel_bytes, width, height,
+                                                                    bmp_color_format, "RGBA8888",
+                                                                    get_bmp_row_orientation(height), "top-down",
+                                                                    out=output_buffer)
+                return Image.fromarray(png_pixel_array)
 
-        for color_index_byte in bmp_pixel_bytes:
-            pixel_array = color_palette_array[0][color_index_byte]
-            png_pixel_array.append(pixel_array)
+        elif bmp_bpp == 24 or bmp_bpp == 32:
+            output_buffer = None
+            if buffer_pool is not None:
+                output_buffer = buffer_pool.get_buffer((abs(height), width, 4))
 
-        png_pixel_array = numpy.array(png_pixel_array, dtype=numpy.uint8)
-    else:
-        if bmp_bpp == 16:
-            if bmp_color_format == "RGB565":
-                png_pixel_array = color_conversion.convertRGB565toRGBA8888(bmp_pixel_bytes)
-            elif bmp_color_format == "ARGB1555":
-                png_pixel_array = color_conversion.convertARGB1555toRGBA8888(bmp_pixel_bytes)
-            elif bmp_color_format == "ARGB4444":
-                png_pixel_array = color_conversion.convertARGB4444toRGBA8888(bmp_pixel_bytes)
+            return Image.fromarray(convertTrueColorBMPtoRGBA8888(unpacked_bmp, out=output_buffer))
+        else:
+            raise ValueError("Wrong BPP")
 
-        elif bmp_bpp == 24:
-            numpy_pixel_byte_array = numpy.frombuffer(bmp_pixel_bytes, dtype=numpy.uint8)
+    return RGBA8888ArrayToPNG(png_pixel_array, width, height)
 
-            R_numpy = numpy_pixel_byte_array[2::3]
-            G_numpy = numpy_pixel_byte_array[1::3]
-            B_numpy = numpy_pixel_byte_array[::3]
-            A_numpy = numpy.full(len(bmp_pixel_bytes) // 2, 255, dtype=numpy.uint8)
 
-            png_pixel_array = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1)
+def get_bmp_channel_byte_index(bitmask):
+    # Byte of a little-endian pixel that holds an 8 bit channel, None if the channel isn't there
+    if bitmask == 0:
+        return None
 
-        elif bmp_bpp == 32:
-            numpy_pixel_byte_array = numpy.frombuffer(bmp_pixel_bytes, dtype=numpy.uint8)
+    for byte_index in range(4):
+        if bitmask == 0xFF << (byte_index * 8):
+            return byte_index
 
-            R_numpy = numpy_pixel_byte_array[2::4]
-            G_numpy = numpy_pixel_byte_array[3::4]
-            B_numpy = numpy_pixel_byte_array[::4]
-            A_numpy = numpy_pixel_byte_array[1::4]
+    raise ValueError("Only 8 bits per channel bitmasks are supported, got " + hex(bitmask))
 
-            png_pixel_array = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1)
-        else:
-            raise ValueError("Wrong BPP")
 
+def convertTrueColorBMPtoRGBA8888(unpacked_bmp: BMPv5, out=None) -> numpy.array:
+    """
+    24/32-bit BMP -> (height, width, 4) RGBA8888 array, rows top-down
+    Pixels are read through a reshaped view (padding is skipped by BMPv5),
+    channel order comes from the bitmasks (BI_BITFIELDS) or is BGR(X) (BI_RGB)
+    """
+    bmp_bpp = unpacked_bmp.image_header["BPP"]
     width = unpacked_bmp.image_header["Image Width"]
     height = unpacked_bmp.image_header["Image Height"]
 
-    png_pixel_array = png_pixel_array.reshape(abs(height), width, 4)
+    if bmp_bpp != 24 and bmp_bpp != 32:
+        raise ValueError("Wrong BPP")
+
+    byte_count_per_pixel = bmp_bpp // 8
 
+    if bmp_bpp == 32 and unpacked_bmp.image_header["Compression"] == 3:
+        channel_byte_index_list = [get_bmp_channel_byte_index(unpacked_bmp.image_header[bitmask_name])
+                                   for bitmask_name in ("R Bitmask", "G Bitmask", "B Bitmask", "A Bitmask")]
+    else:
+        # The 4th byte of BI_RGB pixels isn't alpha
+        channel_byte_index_list = [2, 1, 0, None]
+
+    pixel_array = unpacked_bmp.get_pixel_row_array().reshape(abs(height), width, byte_count_per_pixel)
+
+    if get_bmp_row_orientation(height) == "bottom-up":
+        pixel_array = pixel_array[::-1]
+
+    if out is None:
+        png_pixel_array = numpy.empty((abs(height), width, 4), dtype=numpy.uint8)
+    else:
+        png_pixel_array = color_conversion.get_output_array(out, (abs(height), width, 4))
+
+    for channel_index, byte_index in enumerate(channel_byte_index_list):
+        if byte_index is None:
+            png_pixel_array[:, :, channel_index] = 255
+        else:
+            png_pixel_array[:, :, channel_index] = pixel_array[:, :, byte_index]
+
+    return png_pixel_array
+
+
+def get_bmp_row_orientation(bmp_height) -> str:
     # GIMP flips the image by flipping pixel bytes.
     # SR2 Tools doesn't and instead sets negative height in the header like it supposed to be done.
     # GIMP doesn't like this and will show an error every time you open a BMP like this
-    if height < 0:
-        numpy.flip(png_pixel_array)
+    if bmp_height < 0:
+        return "top-down"
+    return "bottom-up"
+
+
+def RGBA8888ArrayToPNG(png_pixel_array, width, height) -> Image:
+    png_pixel_array = png_pixel_array.reshape(abs(height), width, 4)
+
+    # Reversed row view, PIL copies it in order
+    if get_bmp_row_orientation(height) == "bottom-up":
+        png_pixel_array = png_pixel_array[::-1]
 
     png_output = Image.fromarray(png_pixel_array)
 
     return png_output
 
 
+def SubtextureToPNG(sr2_texture, texture_id, buffer_pool=None) -> Image:
+    """
+    Sub-texture of an unpacked SR2Texture straight to PIL Image, without a BMP in between
+    With buffer_pool the Image shares its pixels with a pooled buffer, save it before the next conversion
+    """
+    output_buffer = None
+    if buffer_pool is not None:
+        image_width, image_height = sr2_texture.get_subtexture_resolution(texture_id)
+        output_buffer = buffer_pool.get_buffer((abs(image_height), image_width, 4))
+
+    return Image.fromarray(sr2_texture.get_rgba8888_array(texture_id, out=output_buffer))
+
+
+# PIL's own defaults are compress_level=6, optimize=False
+png_save_presets = {
+    "default": {"compress_level": 6, "optimize": False},
+    "fast": {"compress_level": 1, "optimize": False},  # Iteration builds, bigger files
+    "small": {"compress_level": 9, "optimize": True},  # Release packaging, slow
+}
+
+
+def get_png_save_options(png_preset="default", compress_level=None, optimize=None) -> dict:
+    # compress_level and optimize override the preset
+    if png_preset not in png_save_presets:
+        raise ValueError("Unknown PNG preset: " + str(png_preset))
+
+    png_save_options = dict.copy(png_save_presets[png_preset])
+
+    if compress_level is not None:
+        png_save_options["compress_level"] = compress_level
+    if optimize is not None:
+        png_save_options["optimize"] = optimize
+
+    return png_save_options
+
+
+def BMPlistToPNGlist(unpacked_bmp_list: list) -> list:
+    """
+    BMPtoPNG for a whole texture file
+    Plain 16-bit BMPs are converted together, one call per color format
+    Paletted and 24/32-bit BMPs still go through BMPtoPNG one by one
+    """
+    png_output_list = [None] * len(unpacked_bmp_list)
+    bmp_index_dict = {}  # Color format: BMP indexes
+
+    for bmp_index, unpacked_bmp in enumerate(unpacked_bmp_list):
+        bmp_color_format = unpacked_bmp.check_color_format()
+
+        if (unpacked_bmp.image_header["BPP"] == 16 and len(unpacked_bmp.color_table_bytes) == 0
+                and bmp_color_format in ("RGB565", "ARGB1555", "ARGB4444")):
+            bmp_index_dict.setdefault(bmp_color_format, []).append(bmp_index)
+        else:
+            png_output_list[bmp_index] = BMPtoPNG(unpacked_bmp)
+
+    for bmp_color_format, bmp_index_list in bmp_index_dict.items():
+        pixel_bytes_list = [unpacked_bmp_list[bmp_index].pixel_bytes for bmp_index in bmp_index_list]
+        png_pixel_array_list = color_conversion.convert16bitListToRGBA8888(pixel_bytes_list, bmp_color_format)
+
+        for bmp_index, png_pixel_array in zip(bmp_index_list, png_pixel_array_list):
+            image_header = unpacked_bmp_list[bmp_index].image_header
+            png_output_list[bmp_index] = RGBA8888ArrayToPNG(png_pixel_array,
+                                                            image_header["Image Width"],
+                                                            image_header["Image Height"])
+
+    return png_output_list
+
+
 def PNGtoBMP(unpacked_png: Image, output_color_format) -> BMPv5:
     """
     Turn PNG into pixel array
     Convert the array into 16-bit pixel bytes
     Assemble BMP out of it
     """
-    width, height = unpacked_png.size
-    png_numpy_array = numpy.asarray(unpacked_png, dtype=numpy.uint8)
-    numpy.flip(png_numpy_array)
+    return RGBA8888ArrayToBMP(numpy.asarray(unpacked_png, dtype=numpy.uint8), output_color_format)
+
+
+def RGBA8888ArrayToBMP(png_numpy_array, output_color_format) -> BMPv5:
+    # (height, width, 3 or 4) array of an already decoded PNG
+    height, width = png_numpy_array.shape[:2]
 
     converted_pixel_bytes = b''
 
-    if output_color_format == "RGB565":
-        converted_pixel_bytes = color_conversion.convertRGBA8888toRGB565bytes(png_numpy_array)
-    elif output_color_format == "ARGB1555":
-        converted_pixel_bytes = color_conversion.convertRGBA8888toARGB1555bytes(png_numpy_array)
-    elif output_color_format == "ARGB4444":
-        converted_pixel_bytes = color_conversion.convertRGBA8888toARGB4444bytes(png_numpy_array)
+    # PNG rows are top-down, same as the BMP with negative height below
+    if output_color_format in ("RGB565", "ARGB1555", "ARGB4444"):
+        converted_pixel_bytes = color_conversion.transcode_pixels(png_numpy_array, width, height,
+                                                                  "RGBA8888", output_color_format)
 
     output_bmp = BMPv5()
     output_bmp.set_resolution(width, height)
@@ -115,3 +231,112 @@ def PNGtoBMP(unpacked_png: Image, output_color_format) -> BMPv5:
     output_bmp.pixel_bytes = converted_pixel_bytes
 
     return output_bmp
+
+
+def RGBA8888ArrayListToBMPlist(png_numpy_array_list: list, output_color_format_list: list) -> list:
+    """
+    RGBA8888ArrayToBMP for a whole texture group
+    Arrays with the same color format and channel count are converted together, one call per format
+    """
+    bmp_output_list = []
+    array_index_dict = {}  # (color format, channel count): array indexes
+
+    for array_index, (png_numpy_array, output_color_format) in enumerate(zip(png_numpy_array_list,
+                                                                             output_color_format_list)):
+        height, width = png_numpy_array.shape[:2]
+
+        output_bmp = BMPv5()
+        output_bmp.set_resolution(width, height)
+        output_bmp.swapColorFormat(output_color_format)
+        output_bmp.pixel_bytes = b''
+        bmp_output_list.append(output_bmp)
+
+        if output_color_format in ("RGB565", "ARGB1555", "ARGB4444"):
+            array_index_dict.setdefault((output_color_format, png_numpy_array.shape[2]), []).append(array_index)
+
+    for (output_color_format, _), array_index_list in array_index_dict.items():
+        pixel_bytes_list = color_conversion.convertRGBA8888ListTo16bit([png_numpy_array_list[array_index]
+                                                                        for array_index in array_index_list],
+                                                                       output_color_format)
+
+        for array_index, pixel_bytes in zip(array_index_list, pixel_bytes_list):
+            bmp_output_list[array_index].pixel_bytes = pixel_bytes
+
+    return bmp_output_list
+
+
+def benchmark_paletted_BMPtoPNG(texture_path_list=(), repeat_count=3):
+    """
+    Palette loop (as BMPtoPNG used to do it) vs palette gather
+    Runs on paletted sub-textures of the given RTEX/MTEX files, or on a random 512x512 one without them
+    """
+    import time
+
+    def paletted_BMPtoPNG_by_pixels(unpacked_bmp):
+        color_palette_array = numpy.frombuffer(unpacked_bmp.color_table_bytes, dtype=numpy.uint8)
+        color_palette_array = color_palette_array.reshape(1, 256, 4).copy()
+
+        for color_array_index in range(len(color_palette_array[0])):
+            R = color_palette_array[0, color_array_index, 2]
+            G = color_palette_array[0, color_array_index, 1]
+            B = color_palette_array[0, color_array_index, 0]
+
+            color_palette_array[0, color_array_index, 0] = R
+            color_palette_array[0, color_array_index, 1] = G
+            color_palette_array[0, color_array_index, 2] = B
+            color_palette_array[0, color_array_index, 3] = 255
+
+        if unpacked_bmp.check_color_format() == "ARGB1555":
+            color_palette_array[0, 0, 3] = 0
+
+        png_pixel_array = []
+        for color_index_byte in unpacked_bmp.pixel_bytes:
+            png_pixel_array.append(color_palette_array[0][color_index_byte])
+
+        png_pixel_array = numpy.array(png_pixel_array, dtype=numpy.uint8)
+        return png_pixel_array.reshape(abs(unpacked_bmp.image_header["Image Height"]),
+                                       unpacked_bmp.image_header["Image Width"], 4)
+
+    paletted_bmp_list = []
+
+    if texture_path_list:
+        from texture_tool import convertTXRtoBMPlist
+
+        for texture_path in texture_path_list:
+            for sub_texture_id, unpacked_bmp in enumerate(convertTXRtoBMPlist(texture_path)):
+                if len(unpacked_bmp.color_table_bytes) > 0:
+                    paletted_bmp_list.append((texture_path + " #" + str(sub_texture_id), unpacked_bmp))
+    else:
+        random_generator = numpy.random.default_rng(0)
+
+        for bmp_color_format in ("RGB565", "ARGB1555"):
+            unpacked_bmp = BMPv5()
+            unpacked_bmp.set_resolution(512, 512)
+            unpacked_bmp.swapColorFormat(bmp_color_format)
+            unpacked_bmp.image_header["BPP"] = 8
+            unpacked_bmp.color_table_bytes = random_generator.integers(0, 256, 1024, dtype=numpy.uint8).tobytes()
+            unpacked_bmp.pixel_bytes = random_generator.integers(0, 256, 512 * 512, dtype=numpy.uint8).tobytes()
+            paletted_bmp_list.append(("random 512x512 " + bmp_color_format, unpacked_bmp))
+
+    for bmp_name, unpacked_bmp in paletted_bmp_list:
+        start_time = time.perf_counter()
+        for _ in range(repeat_count):
+            old_png_pixel_array = paletted_BMPtoPNG_by_pixels(unpacked_bmp)
+        old_time = (time.perf_counter() - start_time) / repeat_count
+
+        start_time = time.perf_counter()
+        for _ in range(repeat_count):
+            new_png_pixel_array = numpy.asarray(BMPtoPNG(unpacked_bmp))
+        new_time = (time.perf_counter() - start_time) / repeat_count
+
+        if not numpy.array_equal(old_png_pixel_array, new_png_pixel_array):
+            raise ValueError(bmp_name + ": paletted conversion results don't match")
+
+        print("{}: pixel loop {:.4f} s, palette gather {:.4f} s".format(bmp_name, old_time, new_time))
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python bmp_png_conversion.py [paletted RTEX/MTEX files]
+    benchmark_paletted_BMPtoPNG(sys.argv[1:])
@@ -4,12 +4,54 @@ Split into individual functions for speed. You know what speed is, right, Python
 """
 import numpy
 
+
+def get_output_array(out, shape) -> numpy.array:
+    """
+    View of a caller-supplied output buffer in the needed shape
+    NumPy arrays have to be uint8 and contiguous, bytearrays (or any writable buffer) get an uint8 view
+    """
+    if isinstance(out, numpy.ndarray):
+        if out.dtype != numpy.uint8:
+            raise TypeError("Output array has to be uint8")
+        # reshape would silently copy these and the output would be lost
+        if not out.flags.c_contiguous:
+            raise ValueError("Output array has to be contiguous")
+        output_array = out
+    else:
+        output_array = numpy.frombuffer(out, dtype=numpy.uint8)
+
+    if output_array.size != numpy.prod(shape):
+        raise ValueError("Output buffer has a wrong size")
+
+    return output_array.reshape(shape)
+
+
+class ConversionBufferPool:
+    """
+    One preallocated array per shape, so converting lots of same-sized textures stops allocating
+    A buffer is handed out again by the next get_buffer call with the same shape,
+    so use it up (save the image, copy the bytes) before asking for another one
+    """
+
+    def __init__(self):
+        self.buffer_dict = {}
+
+    def get_buffer(self, shape) -> numpy.array:
+        shape = tuple(shape)
+        if shape not in self.buffer_dict:
+            self.buffer_dict[shape] = numpy.empty(shape, dtype=numpy.uint8)
+        return self.buffer_dict[shape]
+
+    def clear(self):
+        self.buffer_dict = {}
+
+
 '''
 16 bit to RGBA8888
 '''
 
 
-def convertRGB565toRGBA8888(pixel_byte_array) -> numpy.array:
+def convertRGB565toRGBA8888(pixel_byte_array, out=None) -> numpy.array:
     numpy_pixel_byte_array = numpy.frombuffer(pixel_byte_array, dtype=numpy.uint8)
 
     # Base convertion
@@ -23,12 +65,15 @@ def convertRGB565toRGBA8888(pixel_byte_array) -> numpy.array:
     G_numpy = G_numpy + (G_numpy // 4) // 16
     B_numpy = B_numpy + (B_numpy // 8) // 4
 
-    rgba8888_pixel_list_numpy = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1)
+    if out is not None:
+        out = get_output_array(out, (len(R_numpy), 4))
+
+    rgba8888_pixel_list_numpy = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1, out=out)
 
     return rgba8888_pixel_list_numpy
 
 
-def convertARGB1555toRGBA8888(pixel_byte_array) -> numpy.array:
+def convertARGB1555toRGBA8888(pixel_byte_array, out=None) -> numpy.array:
     numpy_pixel_byte_array = numpy.frombuffer(pixel_byte_array, dtype=numpy.uint8)
 
     # Base convertion
@@ -43,12 +88,15 @@ def convertARGB1555toRGBA8888(pixel_byte_array) -> numpy.array:
     B_numpy = B_numpy + (B_numpy // 8) // 4
     A_numpy = A_numpy * 255
 
-    rgba8888_pixel_list_numpy = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1)
+    if out is not None:
+        out = get_output_array(out, (len(R_numpy), 4))
+
+    rgba8888_pixel_list_numpy = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1, out=out)
 
     return rgba8888_pixel_list_numpy
 
 
-def convertARGB4444toRGBA8888(pixel_byte_array) -> numpy.array:
+def convertARGB4444toRGBA8888(pixel_byte_array, out=None) -> numpy.array:
     numpy_pixel_byte_array = numpy.frombuffer(pixel_byte_array, dtype=numpy.uint8)
 
     # Base convertion
@@ -63,17 +111,68 @@ def convertARGB4444toRGBA8888(pixel_byte_array) -> numpy.array:
     B_numpy = B_numpy + (B_numpy // 16)
     A_numpy = A_numpy + (A_numpy // 16)
 
-    rgba8888_pixel_list_numpy = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1)
+    if out is not None:
+        out = get_output_array(out, (len(R_numpy), 4))
+
+    rgba8888_pixel_list_numpy = numpy.stack((R_numpy, G_numpy, B_numpy, A_numpy), axis=1, out=out)
 
     return rgba8888_pixel_list_numpy
 
 
+'''
+16 bit to RGBA8888 through lookup tables
+Every 16 bit value is converted once with the functions above, so the results are the same bit for bit
+'''
+
+RGBA8888_lookup_table_converters = {
+    "RGB565": convertRGB565toRGBA8888,
+    "ARGB1555": convertARGB1555toRGBA8888,
+    "ARGB4444": convertARGB4444toRGBA8888
+}
+
+RGBA8888_lookup_tables = {}
+
+
+def get_RGBA8888_lookup_table(color_format) -> numpy.array:
+    # 65536x4, built on first use
+    if color_format not in RGBA8888_lookup_tables:
+        all_16bit_values = numpy.arange(65536, dtype="<u2").tobytes()
+        lookup_table = RGBA8888_lookup_table_converters[color_format](all_16bit_values)
+        lookup_table.setflags(write=False)
+        RGBA8888_lookup_tables[color_format] = lookup_table
+
+    return RGBA8888_lookup_tables[color_format]
+
+
+def convert16bitToRGBA8888(pixel_byte_array, color_format, out=None) -> numpy.array:
+    numpy_pixel_array = numpy.frombuffer(pixel_byte_array, dtype="<u2")
+
+    if out is not None:
+        out = get_output_array(out, (len(numpy_pixel_array), 4))
+
+    return get_RGBA8888_lookup_table(color_format).take(numpy_pixel_array, axis=0, out=out)
+
+
+def convertColorTableToRGBA8888(color_table_bytes, color_format) -> numpy.array:
+    # BGRA color table -> (256, 4) RGBA palette, the 4th byte of the color table isn't alpha
+    color_table_array = numpy.frombuffer(color_table_bytes, dtype=numpy.uint8, count=1024).reshape(256, 4)
+
+    color_palette_array = numpy.empty((256, 4), dtype=numpy.uint8)
+    color_palette_array[:, :3] = color_table_array[:, 2::-1]
+    color_palette_array[:, 3] = 255
+
+    if color_format == "ARGB1555":
+        color_palette_array[0, 3] = 0  # First color is transparent
+
+    return color_palette_array
+
+
 '''
 RGBA8888 to 16 bit
 '''
 
 
-def convertRGBA8888toRGB565bytes(png_numpy_array) -> bytes:
+def convertRGBA8888toRGB565bytes(png_numpy_array, out=None) -> bytes:
 
     color_channel_count = png_numpy_array.shape[2]
 
@@ -90,12 +189,17 @@ def convertRGBA8888toRGB565bytes(png_numpy_array) -> bytes:
     RG_numpy = (R_numpy >> 3) + (G_numpy << 3)
     GB_numpy = (G_numpy >> 5) + B_numpy
 
+    # Returns out itself, if given
+    if out is not None:
+        numpy.stack((RG_numpy, GB_numpy), axis=1, out=get_output_array(out, (len(RG_numpy), 2)))
+        return out
+
     color_bytes_array = numpy.stack((RG_numpy, GB_numpy), axis=1)
 
     return color_bytes_array.tobytes()
 
 
-def convertRGBA8888toARGB1555bytes(png_numpy_array) -> bytes:
+def convertRGBA8888toARGB1555bytes(png_numpy_array, out=None) -> bytes:
 
     color_channel_count = png_numpy_array.shape[2]
 
@@ -114,12 +218,17 @@ def convertRGBA8888toARGB1555bytes(png_numpy_array) -> bytes:
     ARG_numpy = A_numpy + (R_numpy >> 1) + (G_numpy >> 6)
     GB_numpy = (G_numpy << 2) + (B_numpy >> 3)
 
+    # Returns out itself, if given
+    if out is not None:
+        numpy.stack((GB_numpy, ARG_numpy), axis=1, out=get_output_array(out, (len(GB_numpy), 2)))
+        return out
+
     color_bytes_array = numpy.stack((GB_numpy, ARG_numpy), axis=1)
 
     return color_bytes_array.tobytes()
 
 
-def convertRGBA8888toARGB4444bytes(png_numpy_array) -> bytes:
+def convertRGBA8888toARGB4444bytes(png_numpy_array, out=None) -> bytes:
     color_channel_count = png_numpy_array.shape[2]
 
     png_flat_numpy_array = png_numpy_array.ravel()
@@ -137,7 +246,188 @@ def convertRGBA8888toARGB4444bytes(png_numpy_array) -> bytes:
     AR_numpy = A_numpy + (R_numpy >> 4)
     GB_numpy = G_numpy + (B_numpy >> 4)
 
+    # Returns out itself, if given
+    if out is not None:
+        numpy.stack((GB_numpy, AR_numpy), axis=1, out=get_output_array(out, (len(GB_numpy), 2)))
+        return out
+
     color_bytes_array = numpy.stack((GB_numpy, AR_numpy), axis=1)
 
     return color_bytes_array.tobytes()
 
+
+'''
+Batches of same-format sub-textures
+One conversion call for the whole batch, results are split back into views of one shared buffer
+'''
+
+RGBA8888_to_16bit_converters = {
+    "RGB565": convertRGBA8888toRGB565bytes,
+    "ARGB1555": convertRGBA8888toARGB1555bytes,
+    "ARGB4444": convertRGBA8888toARGB4444bytes,
+}
+
+
+def convert16bitListToRGBA8888(pixel_bytes_list, color_format) -> list:
+    """
+    List of 16 bit pixel buffers -> list of (pixel count, 4) RGBA8888 arrays
+    """
+    split_positions = numpy.cumsum([len(pixel_bytes) // 2 for pixel_bytes in pixel_bytes_list])[:-1]
+
+    rgba8888_pixel_array = convert16bitToRGBA8888(b''.join(pixel_bytes_list), color_format)
+
+    return numpy.split(rgba8888_pixel_array, split_positions)
+
+
+def convertRGBA8888ListTo16bit(png_numpy_array_list, color_format) -> list:
+    """
+    List of (height, width, channels) arrays -> list of 16 bit pixel bytes as memoryviews
+    All arrays have to have the same channel count
+    """
+    channel_count = png_numpy_array_list[0].shape[2]
+    pixel_counts = [png_numpy_array.shape[0] * png_numpy_array.shape[1] for png_numpy_array in png_numpy_array_list]
+
+    joined_numpy_array = numpy.concatenate([png_numpy_array.reshape(-1, channel_count)
+                                            for png_numpy_array in png_numpy_array_list])
+
+    output_bytes = bytearray(len(joined_numpy_array) * 2)
+    RGBA8888_to_16bit_converters[color_format](joined_numpy_array.reshape(1, -1, channel_count), out=output_bytes)
+
+    output_view = memoryview(output_bytes)
+    output_bytes_list = []
+    byte_position = 0
+    for pixel_count in pixel_counts:
+        output_bytes_list.append(output_view[byte_position:byte_position + pixel_count * 2])
+        byte_position += pixel_count * 2
+
+    return output_bytes_list
+
+
+'''
+Color conversion and row reordering in one pass
+'''
+
+
+def pack_RGB565(R_numpy, G_numpy, B_numpy, A_numpy, out=None) -> numpy.array:
+    packed_numpy = (R_numpy & 0b11111000).astype(numpy.uint16) << 8
+    packed_numpy |= (G_numpy & 0b11111100).astype(numpy.uint16) << 3
+    return numpy.bitwise_or(packed_numpy, B_numpy >> 3, out=out)
+
+
+def pack_ARGB1555(R_numpy, G_numpy, B_numpy, A_numpy, out=None) -> numpy.array:
+    packed_numpy = (R_numpy & 0b11111000).astype(numpy.uint16) << 7
+    packed_numpy |= (G_numpy & 0b11111000).astype(numpy.uint16) << 2
+    packed_numpy |= B_numpy >> 3
+    if A_numpy is None:
+        packed_numpy |= 0x8000
+        return numpy.copyto(out, packed_numpy) if out is not None else packed_numpy
+    return numpy.bitwise_or(packed_numpy, (A_numpy & 0b10000000).astype(numpy.uint16) << 8, out=out)
+
+
+def pack_ARGB4444(R_numpy, G_numpy, B_numpy, A_numpy, out=None) -> numpy.array:
+    packed_numpy = (R_numpy & 0b11110000).astype(numpy.uint16) << 4
+    packed_numpy |= G_numpy & 0b11110000
+    packed_numpy |= B_numpy >> 4
+    if A_numpy is None:
+        packed_numpy |= 0xF000
+        return numpy.copyto(out, packed_numpy) if out is not None else packed_numpy
+    return numpy.bitwise_or(packed_numpy, (A_numpy & 0b11110000).astype(numpy.uint16) << 8, out=out)
+
+
+pixel_packers = {
+    "RGB565": pack_RGB565,
+    "ARGB1555": pack_ARGB1555,
+    "ARGB4444": pack_ARGB4444,
+}
+
+
+def transcode_pixels(source_pixels, image_width, image_height, source_format, destination_format,
+                     source_orientation="top-down", destination_orientation="top-down", out=None):
+    """
+    Converts colors and puts rows in the destination order without an extra flip pass
+    Formats: RGB565, ARGB1555, ARGB4444 (pixel bytes) and RGBA8888 ((height, width, 3 or 4) array or bytes)
+    Orientation is "top-down" or "bottom-up", rows are reversed only if they differ
+    RGBA8888 comes out as a (height, width, 4) array, 16 bit formats as bytes
+    With out= the result is written into out and out is returned
+    """
+    image_height = abs(image_height)
+    row_step = 1 if source_orientation == destination_orientation else -1
+
+    # Reversed row views, nothing is copied yet
+    if source_format == "RGBA8888":
+        source_array = numpy.asarray(source_pixels, dtype=numpy.uint8)
+        source_array = source_array.reshape(image_height, image_width, -1)[::row_step]
+    else:
+        source_array = numpy.frombuffer(source_pixels, dtype="<u2", count=image_width * image_height)
+        source_array = source_array.reshape(image_height, image_width)[::row_step]
+
+    if destination_format == "RGBA8888":
+        output_array = numpy.empty((image_height, image_width, 4), dtype=numpy.uint8) if out is None \
+            else get_output_array(out, (image_height, image_width, 4))
+
+        if source_format == "RGBA8888":
+            output_array[:, :, :source_array.shape[2]] = source_array
+            if source_array.shape[2] == 3:
+                output_array[:, :, 3] = 255
+        else:
+            get_RGBA8888_lookup_table(source_format).take(source_array, axis=0, out=output_array)
+
+        return out if out is not None else output_array
+
+    output_array = None
+    if out is not None:
+        output_array = get_output_array(out, (image_height, image_width * 2)).view("<u2")
+
+    if source_format == destination_format:
+        if output_array is None:
+            return source_array.tobytes()
+        output_array[:] = source_array
+        return out
+
+    # 16 bit to another 16 bit format goes through RGBA8888
+    if source_format != "RGBA8888":
+        source_array = get_RGBA8888_lookup_table(source_format)[source_array]
+
+    A_numpy = source_array[:, :, 3] if source_array.shape[2] == 4 else None
+
+    packed_array = pixel_packers[destination_format](source_array[:, :, 0],
+                                                     source_array[:, :, 1],
+                                                     source_array[:, :, 2],
+                                                     A_numpy,
+                                                     out=output_array)
+
+    if out is not None:
+        return out
+    return packed_array.astype("<u2", copy=False).tobytes()
+
+
+def benchmark_RGBA8888_lookup_tables(repeat_count=5):
+    import time
+
+    random_generator = numpy.random.default_rng(0)
+
+    for color_format in RGBA8888_lookup_table_converters:
+        get_RGBA8888_lookup_table(color_format)
+
+        for image_width in (32, 64, 128, 256, 512, 1024):
+            pixel_bytes = random_generator.integers(0, 256, image_width * image_width * 2, dtype=numpy.uint8).tobytes()
+
+            start_time = time.perf_counter()
+            for _ in range(repeat_count):
+                old_rgba8888_array = RGBA8888_lookup_table_converters[color_format](pixel_bytes)
+            old_time = (time.perf_counter() - start_time) / repeat_count
+
+            start_time = time.perf_counter()
+            for _ in range(repeat_count):
+                new_rgba8888_array = convert16bitToRGBA8888(pixel_bytes, color_format)
+            new_time = (time.perf_counter() - start_time) / repeat_count
+
+            if not numpy.array_equal(old_rgba8888_array, new_rgba8888_array):
+                raise ValueError(color_format + " lookup table results don't match")
+
+            print("{0} {1}x{1}: formulas {2:.6f} s, lookup table {3:.6f} s".format(color_format, image_width,
+                                                                                  old_time, new_time))
+
+
+if __name__ == "__main__":
+    benchmark_RGBA8888_lookup_tables()
@@ -0,0 +1,157 @@
+"""
+Persistent index of the files in a BINDATA tree: path, type, size and modified time
+Types come from the first 16 bytes, so a rescan only opens new or changed files
+"""
+import collections
+import json
+import os
+import struct
+import time
+
+INDEX_VERSION = 1
+FILE_HEADER_READ_SIZE = 16
+
+texture_file_types = ("RTEX", "RHBG", "MTEX", "RTXR")
+
+
+def classify_file_header(file_name, file_size, header_bytes) -> str:
+    """
+    RTEX, RHBG, MTEX, RTXR, SARC, MDL, BIN or Other
+    .BIN archives (B_CARTEX.BIN and friends) can start like a texture, so the extension goes first for them
+    """
+    file_signature = bytes(header_bytes[:4])
+
+    if file_signature == b'SARC':
+        return "SARC"
+    if file_name[-4:] == ".BIN" or file_name[-4:] == ".bin":
+        return "BIN"
+    if file_signature in (b'RTEX', b'RHBG', b'MTEX', b'RTXR'):
+        return file_signature.decode()
+
+    # No signature, but models start with their file size and 0x20 for the header size
+    if len(header_bytes) >= 8 and struct.unpack_from("<2I", header_bytes) == (file_size, 0x20):
+        return "MDL"
+    if file_name[-4:] == ".mdl" or file_name[-4:] == ".MDL":
+        return "MDL"
+
+    return "Other"
+
+
+def get_file_type(file_path) -> str:
+    # Single file version of what FileIndex.scan does
+    with open(file_path, "rb") as input_file:
+        header_bytes = input_file.read(FILE_HEADER_READ_SIZE)
+    return classify_file_header(os.path.basename(file_path), os.path.getsize(file_path), header_bytes)
+
+
+class FileIndex:
+    """
+    index_path=None keeps the index in memory only
+    Paths are stored the way scan builds them (os.path.join of the scanned folder and the names inside)
+    """
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.entry_dict = {}
+        self.load()
+
+    def load(self):
+        if self.index_path is None:
+            return
+
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as index_file:
+                file_index = json.load(index_file)
+        except (OSError, ValueError):
+            # No index yet or a broken one, the next scan reads everything again
+            return
+
+        if file_index.get("Version") == INDEX_VERSION:
+            self.entry_dict = file_index["Entries"]
+
+    def save(self):
+        if self.index_path is None:
+            return
+
+        if os.path.dirname(self.index_path):
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as index_file:
+            json.dump({"Version": INDEX_VERSION, "Entries": self.entry_dict}, index_file, indent=1)
+        os.replace(temporary_path, self.index_path)
+
+    def scan(self, folder_path) -> list:
+        """
+        Walks folder_path with os.scandir and brings its entries up to date
+        Files with the same size and modified time as in the index aren't opened
+        Returns the paths of all files in the folder
+        """
+        start_time = time.perf_counter()
+        read_file_count = 0
+        file_path_list = []
+
+        folder_stack = [folder_path]
+        while folder_stack:
+            current_folder = folder_stack.pop()
+
+            with os.scandir(current_folder) as folder_entries:
+                for folder_entry in folder_entries:
+                    # Symlinks aren't followed, a link back to a parent folder would never end
+                    if folder_entry.is_dir(follow_symlinks=False):
+                        folder_stack.append(folder_entry.path)
+                        continue
+                    if not folder_entry.is_file(follow_symlinks=False):
+                        continue
+
+                    file_path = folder_entry.path
+                    file_path_list.append(file_path)
+
+                    # Comes from the directory listing on Windows, no extra call per file
+                    file_stat = folder_entry.stat()
+                    index_entry = self.entry_dict.get(file_path)
+                    if (index_entry is not None and index_entry["Size"] == file_stat.st_size
+                            and index_entry["Modified Time"] == file_stat.st_mtime_ns):
+                        continue
+
+                    with open(file_path, "rb") as input_file:
+                        header_bytes = input_file.read(FILE_HEADER_READ_SIZE)
+                    read_file_count += 1
+
+                    self.entry_dict[file_path] = {"Type": classify_file_header(folder_entry.name, file_stat.st_size,
+                                                                              header_bytes),
+                                                  "Size": file_stat.st_size,
+                                                  "Modified Time": file_stat.st_mtime_ns}
+
+        # Files deleted from the scanned folder
+        file_path_set = set(file_path_list)
+        folder_prefix = os.path.join(folder_path, "")
+        for file_path in [file_path for file_path in self.entry_dict
+                          if file_path.startswith(folder_prefix) and file_path not in file_path_set]:
+            del self.entry_dict[file_path]
+
+        print("Indexed {} files in {:.2f} s ({} read)".format(len(file_path_list), time.perf_counter() - start_time,
+                                                              read_file_count))
+
+        return sorted(file_path_list)
+
+    def query(self, file_types=None, folder_path=None) -> list:
+        """
+        Indexed paths, optionally only the ones of file_types (like texture_file_types) inside folder_path
+        """
+        folder_prefix = None
+        if folder_path is not None:
+            folder_prefix = os.path.join(folder_path, "")
+
+        return sorted(file_path for file_path, index_entry in self.entry_dict.items()
+                      if (file_types is None or index_entry["Type"] in file_types)
+                      and (folder_prefix is None or file_path.startswith(folder_prefix)))
+
+    def get_type(self, file_path):
+        # None if file_path isn't indexed
+        index_entry = self.entry_dict.get(file_path)
+        if index_entry is None:
+            return None
+        return index_entry["Type"]
+
+    def get_type_counts(self, folder_path=None) -> collections.Counter:
+        return collections.Counter(self.get_type(file_path) for file_path in self.query(folder_path=folder_path))
@@ -0,0 +1,149 @@
+"""
+On-disk manifest for incremental BINDATA unpacking/packing
+Every entry is keyed by what gets built (a source texture or an output texture) and records
+the inputs it was built from (size, modified time, content hash) and the outputs it produced
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def get_bytes_hash(file_bytes) -> str:
+    # Same hash as get_file_hash, for files that are already read
+    return hashlib.blake2b(file_bytes, digest_size=20).hexdigest()
+
+
+def get_file_hash(file_path, chunk_size=0x100000) -> str:
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as input_file:
+        while chunk := input_file.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_file_state(file_path):
+    # (size, modified time in ns) or None if the file is gone
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+class RebuildManifest:
+    """
+    force=True rebuilds everything, the manifest is still updated so the next run can skip again
+    Size and modified time are checked first, files are only hashed when those changed,
+    so touching a file without changing it doesn't rebuild anything
+    """
+    def __init__(self, manifest_path, force=False):
+        self.manifest_path = manifest_path
+        self.force = force
+        self.entry_dict = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            # No manifest yet or a broken one, everything gets rebuilt
+            return
+
+        if manifest.get("Version") == MANIFEST_VERSION:
+            self.entry_dict = manifest["Entries"]
+
+    def save(self):
+        if os.path.dirname(self.manifest_path):
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+
+        # Written next to the old one and swapped in, so an interrupted save doesn't lose the manifest
+        temporary_path = self.manifest_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as manifest_file:
+            json.dump({"Version": MANIFEST_VERSION, "Entries": self.entry_dict}, manifest_file, indent=1)
+        os.replace(temporary_path, self.manifest_path)
+
+    def is_up_to_date(self, key, input_path_list, settings) -> bool:
+        """
+        True if key was built from the same input files with the same settings and all of its outputs exist
+        """
+        if self.force or key not in self.entry_dict:
+            return False
+
+        entry = self.entry_dict[key]
+        if entry["Settings"] != settings or sorted(entry["Inputs"]) != sorted(input_path_list):
+            return False
+
+        for input_path, input_record in entry["Inputs"].items():
+            input_state = get_file_state(input_path)
+            if input_state is None:
+                return False
+            if input_state == (input_record["Size"], input_record["Modified Time"]):
+                continue
+
+            if input_state[0] != input_record["Size"] or get_file_hash(input_path) != input_record["Hash"]:
+                return False
+            # Same contents, only remember the new time so it isn't hashed again
+            input_record["Modified Time"] = input_state[1]
+
+        for output_path in entry["Outputs"]:
+            if get_file_state(output_path) is None:
+                return False
+
+        return True
+
+    def record(self, key, input_path_list, output_path_list, settings, input_hash_list=None):
+        # input_hash_list: get_bytes_hash of inputs the caller already read, None hashes them here
+        # Outputs the previous build made and this one didn't are stale
+        if key in self.entry_dict:
+            self.remove_outputs(set(self.entry_dict[key]["Outputs"]) - set(output_path_list) - self.get_outputs(key),
+                                self.entry_dict[key]["Outputs"])
+
+        if input_hash_list is None:
+            input_hash_list = [get_file_hash(input_path) for input_path in input_path_list]
+
+        input_record_dict = {}
+        for input_path, input_hash in zip(input_path_list, input_hash_list):
+            input_size, input_modified_time = get_file_state(input_path)
+            input_record_dict[input_path] = {"Size": input_size,
+                                             "Modified Time": input_modified_time,
+                                             "Hash": input_hash}
+
+        output_record_dict = {}
+        for output_path in output_path_list:
+            output_size, output_modified_time = get_file_state(output_path)
+            output_record_dict[output_path] = {"Size": output_size, "Modified Time": output_modified_time}
+
+        self.entry_dict[key] = {"Settings": settings, "Inputs": input_record_dict, "Outputs": output_record_dict}
+
+    def prune(self, current_key_list):
+        """
+        Drops entries that aren't built anymore (their source was deleted) along with their outputs
+        """
+        current_key_set = set(current_key_list)
+        for key in [key for key in self.entry_dict if key not in current_key_set]:
+            self.remove_outputs(set(self.entry_dict[key]["Outputs"]) - self.get_outputs(key),
+                                self.entry_dict[key]["Outputs"])
+            del self.entry_dict[key]
+
+    def get_outputs(self, except_key=None) -> set:
+        # Outputs of all entries but except_key, files with the same name can come from different sources
+        return {output_path for key, entry in self.entry_dict.items() if key != except_key
+                for output_path in entry["Outputs"]}
+
+    @staticmethod
+    def remove_outputs(output_path_list, output_record_dict):
+        # Only files still exactly as they were built are deleted, edited ones are left alone
+        for output_path in sorted(output_path_list):
+            output_state = get_file_state(output_path)
+            if output_state is None:
+                continue
+
+            output_record = output_record_dict[output_path]
+            if output_state == (output_record["Size"], output_record["Modified Time"]):
+                os.remove(output_path)
+                print("Removed stale " + output_path)
+            else:
+                print("Stale output was edited, keeping it: " + output_path)
@@ -1,9 +1,21 @@
 """
 Python classes for handling Sega Rally 2 textures
 """
+import collections
+import hashlib
+import mmap
+import multiprocessing
 import struct
+import numpy
 from bmp_handler import BMPv5
-from unyakuza import unyakuza
+from color_conversion import (convertRGB565toRGBA8888, convertARGB1555toRGBA8888, convertARGB4444toRGBA8888,
+                              convertRGBA8888toRGB565bytes, convertRGBA8888toARGB1555bytes,
+                              convertRGBA8888toARGB4444bytes, convertColorTableToRGBA8888, get_output_array,
+                              transcode_pixels)
+from twiddle import twiddle, untwiddle
+from vector_quantization import build_vq_codebook, find_nearest_codebook_entries
+from unyakuza import unyakuza, unyakuza_checked, unyakuza_fast
+from yakuza import yakuza
 
 
 def fill_dict_from_bytes_by_formatting(dictionary_to_fill: dict, source_bytes: bytes, formatting: str) -> dict:
@@ -82,6 +94,94 @@ sr2_texture_formats = {
 }
 
 
+def map_file_as_memoryview(file_path) -> memoryview:
+    """
+    Read-only memory map of the whole file, slicing it doesn't copy anything
+    The file stays mapped while any slice of it is still around, so don't overwrite it in the meantime
+    """
+    with open(file_path, "rb") as mapped_file:
+        try:
+            file_map = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            return memoryview(b'')
+
+    return memoryview(file_map)
+
+
+class LazyPixelBytesList:
+    """
+    Stands in for pixel_bytes_list when unpacking lazily
+    Sub-textures stay as (offset, size) in the file bytes and get decoded on first access,
+    the last few decoded ones are kept in an LRU cache
+    """
+
+    def __init__(self, texture_file_bytes, subtexture_location_list, decode_function=None, cache_size=8):
+        self.texture_file_bytes = texture_file_bytes
+        self.subtexture_location_list = list.copy(subtexture_location_list)
+        self.decode_function = decode_function  # (texture_index, subtexture_bytes) -> pixel bytes, None keeps them as is
+
+        self.cache_size = cache_size
+        self.decoded_cache = collections.OrderedDict()
+
+        # Sub-textures that were replaced or added, never evicted
+        self.replaced_pixel_bytes = {}
+
+    def __len__(self):
+        return len(self.subtexture_location_list)
+
+    def get_index(self, texture_index):
+        if texture_index < 0:
+            texture_index += len(self)
+        if texture_index < 0 or texture_index >= len(self):
+            raise IndexError("Sub-texture index out of range")
+        return texture_index
+
+    def __getitem__(self, texture_index):
+        texture_index = self.get_index(texture_index)
+
+        if texture_index in self.replaced_pixel_bytes:
+            return self.replaced_pixel_bytes[texture_index]
+
+        if texture_index in self.decoded_cache:
+            self.decoded_cache.move_to_end(texture_index)
+            return self.decoded_cache[texture_index]
+
+        subtexture_offset, subtexture_size = self.subtexture_location_list[texture_index]
+        pixel_bytes = self.texture_file_bytes[subtexture_offset:subtexture_offset + subtexture_size]
+        if self.decode_function is not None:
+            pixel_bytes = self.decode_function(texture_index, pixel_bytes)
+
+        self.decoded_cache[texture_index] = pixel_bytes
+        if len(self.decoded_cache) > self.cache_size:
+            self.decoded_cache.popitem(last=False)
+
+        return pixel_bytes
+
+    def get_stored_bytes(self, texture_index):
+        # Sub-texture bytes as they are in the file, nothing is decoded or cached
+        texture_index = self.get_index(texture_index)
+
+        if texture_index in self.replaced_pixel_bytes:
+            return self.replaced_pixel_bytes[texture_index]
+
+        subtexture_offset, subtexture_size = self.subtexture_location_list[texture_index]
+        return self.texture_file_bytes[subtexture_offset:subtexture_offset + subtexture_size]
+
+    def __setitem__(self, texture_index, pixel_bytes):
+        texture_index = self.get_index(texture_index)
+        self.decoded_cache.pop(texture_index, None)
+        self.replaced_pixel_bytes[texture_index] = pixel_bytes
+
+    def __iter__(self):
+        for texture_index in range(len(self)):
+            yield self[texture_index]
+
+    def append(self, pixel_bytes):
+        self.subtexture_location_list.append(None)
+        self.replaced_pixel_bytes[len(self) - 1] = pixel_bytes
+
+
 class SR2Texture:
 
     def __init__(self, file_signature):
@@ -98,6 +198,13 @@ class SR2Texture:
 
         self.pixel_bytes_list = []
 
+        # Only parse headers when unpacking, sub-textures get decoded when pixel_bytes_list[i] is accessed
+        self.lazy_unpacking = False
+        self.lazy_cache_size = 8
+
+        # Memory map files in unpack_from_file, uncompressed pixel bytes become memoryviews into the file
+        self.memory_mapped_loading = False
+
     def fill_file_header_from_bytes(self, texture_file_bytes):
         file_header_bytes = texture_file_bytes[:self.file_header_size]
 
@@ -133,21 +240,120 @@ class SR2Texture:
         else:
             pixel_bytes_offset = 0x1000
 
+        subtexture_location_list = []
         for texture_header in self.texture_header_list:
-            texture_bytes = texture_file_bytes[pixel_bytes_offset:
-                                               pixel_bytes_offset + texture_header["Image Size (in bytes)"]]
-            self.pixel_bytes_list.append(texture_bytes)
+            subtexture_location_list.append((pixel_bytes_offset, texture_header["Image Size (in bytes)"]))
             pixel_bytes_offset += texture_header["Image Size (in bytes)"]
 
+        self.fill_pixel_bytes_list_by_locations(texture_file_bytes, subtexture_location_list)
+
+    def fill_pixel_bytes_list_by_locations(self, texture_file_bytes, subtexture_location_list):
+        # Cut off files would otherwise give short sub-textures that fail halfway through exporting or export empty
+        for texture_index, (subtexture_offset, subtexture_size) in enumerate(subtexture_location_list):
+            if subtexture_offset + subtexture_size > len(texture_file_bytes):
+                raise ValueError("Sub-texture {} goes past the end of the file".format(texture_index))
+
+        if self.lazy_unpacking:
+            self.pixel_bytes_list = LazyPixelBytesList(texture_file_bytes, subtexture_location_list,
+                                                       self.decode_subtexture, self.lazy_cache_size)
+            return
+
+        for subtexture_offset, subtexture_size in subtexture_location_list:
+            self.pixel_bytes_list.append(texture_file_bytes[subtexture_offset:subtexture_offset + subtexture_size])
+
+    def decode_subtexture(self, texture_index, subtexture_bytes):
+        # For formats that store sub-textures compressed or twiddled
+        return subtexture_bytes
+
     def unpack_from_bytes(self, texture_file_bytes):
         pass
 
     def unpack_from_file(self, texture_file_path):
+        if self.memory_mapped_loading:
+            self.unpack_from_bytes(map_file_as_memoryview(texture_file_path))
+            return
+
         texture_file = open(texture_file_path, "r+b")
         texture_file_bytes = texture_file.read()
         texture_file.close()
         self.unpack_from_bytes(texture_file_bytes)
 
+    def get_subtexture_resolution(self, texture_id) -> tuple:
+        texture_header = self.texture_header_list[texture_id]
+
+        # RTEX and MTEX sub-textures are square
+        return texture_header["Image Width"], texture_header.get("Image Height", texture_header["Image Width"])
+
+    def get_subtexture_color_format(self, texture_id) -> str:
+        return "RGB565"
+
+    def get_subtexture_palette(self, texture_id):
+        # BGRA color table of paletted sub-textures, None otherwise
+        return None
+
+    def setup_bmp(self, texture_id):
+        output_bmp = BMPv5()
+
+        output_bmp.set_resolution(*self.get_subtexture_resolution(texture_id))
+
+        output_bmp.image_header["BPP"] = 16
+        output_bmp.swapColorFormat(self.get_subtexture_color_format(texture_id))
+
+        palette_bytes = self.get_subtexture_palette(texture_id)
+        if palette_bytes is not None:
+            output_bmp.image_header["BPP"] = 8
+            output_bmp.image_header["Color Count"] = 256
+            output_bmp.color_table_bytes = palette_bytes
+
+        return output_bmp
+
+    def get_rgba8888_array(self, texture_id, out=None) -> numpy.array:
+        """
+        Sub-texture as a (height, width, 4) RGBA8888 array, rows top-down
+        Same result as setup_bmp and BMPtoPNG, straight from the header color format
+        """
+        image_width, image_height = self.get_subtexture_resolution(texture_id)
+        image_height = abs(image_height)
+        color_format = self.get_subtexture_color_format(texture_id)
+        pixel_bytes = self.pixel_bytes_list[texture_id]
+
+        palette_bytes = self.get_subtexture_palette(texture_id)
+        if palette_bytes is not None:
+            color_palette_array = convertColorTableToRGBA8888(palette_bytes, color_format)
+            color_index_array = numpy.frombuffer(pixel_bytes, dtype=numpy.uint8, count=image_width * image_height)
+
+            if out is not None:
+                out = get_output_array(out, (image_height, image_width, 4))
+
+            return color_palette_array.take(color_index_array.reshape(image_height, image_width), axis=0, out=out)
+
+        return transcode_pixels(pixel_bytes, image_width, image_height, color_format, "RGBA8888", out=out)
+
+    def get_subtexture_stored_payload_hash(self, texture_id) -> bytes:
+        """
+        Hash of the sub-texture as stored in the file (still compressed/twiddled), its header and palette
+        Unpack with lazy_unpacking, nothing gets decoded then and repeats are found before decoding them
+        (MTEX and RTXR keep only the decoded pixels otherwise)
+        Sub-textures with the same hash export to the same BMP/PNG, even from different files
+        """
+        palette_bytes = self.get_subtexture_palette(texture_id)
+        # Where the sub-texture is in the file doesn't change what it decodes to
+        texture_header = {header_key: header_value for header_key, header_value
+                          in self.texture_header_list[texture_id].items() if header_key != "Pixel Offset"}
+
+        if isinstance(self.pixel_bytes_list, LazyPixelBytesList):
+            subtexture_bytes = self.pixel_bytes_list.get_stored_bytes(texture_id)
+        else:
+            subtexture_bytes = self.pixel_bytes_list[texture_id]
+
+        payload_hash = hashlib.blake2b(digest_size=20)
+        payload_hash.update(repr((self.file_header["Signature"], texture_header, palette_bytes is not None)).encode())
+        if palette_bytes is not None:
+            payload_hash.update(palette_bytes)
+        payload_hash.update(subtexture_bytes)
+
+        return payload_hash.digest()
+
     def pack_file_header(self) -> bytes:
         return struct.pack(self.file_header_formatting, *self.file_header.values())
 
@@ -212,19 +418,12 @@ class RHBG(SR2Texture):
 
         return file_header_bytes + texture_header_bytes + pixel_bytes
 
-    def setup_bmp(self, texture_id):
-        output_bmp = BMPv5()
-
-        output_bmp.set_resolution(self.texture_header_list[0]["Image Width"],
-                                  self.texture_header_list[0]["Image Height"])
-
-        return output_bmp
-
     def convert_bmp_headers_to_texture_header(self, bmp_input):
         sub_texture_header = dict.copy(self.texture_header)
 
         sub_texture_header["Image Width"] = bmp_input.image_header["Image Width"]
-        sub_texture_header["Image Height"] = bmp_input.image_header["Image Height"]
+        # Top-down BMPs (like the ones SR2Tools writes) have a negative height
+        sub_texture_header["Image Height"] = abs(bmp_input.image_header["Image Height"])
         sub_texture_header["Image Size (in bytes)"] = len(bmp_input.pixel_bytes)
 
         # Color Format
@@ -239,6 +438,16 @@ class RHBG(SR2Texture):
         self.texture_header_list.append(sub_texture_header)
 
 
+def get_RTEX_color_format_name(color_format) -> str:
+    # RTEX and RTXR color format codes
+    if color_format == 2:
+        return "ARGB1555"
+    elif color_format == 8:
+        return "ARGB4444"
+    else:
+        return "RGB565"
+
+
 class RTEX(SR2Texture):
 
     def __init__(self):
@@ -302,33 +511,18 @@ class RTEX(SR2Texture):
 
         return file_header_bytes + all_texture_header_bytes + all_palette_bytes + padding_bytes + all_pixel_bytes
 
-    def setup_bmp(self, texture_id):
-        current_subtexture_header = self.texture_header_list[texture_id]
-        output_bmp = BMPv5()
-
-        output_bmp.set_resolution(current_subtexture_header["Image Width"],
-                                  current_subtexture_header["Image Width"])
+    def get_subtexture_color_format(self, texture_id) -> str:
+        return get_RTEX_color_format_name(self.texture_header_list[texture_id]["Color Format"])
 
-        output_bmp.image_header["BPP"] = 16
-        if current_subtexture_header["Color Format"] == 2:
-            output_bmp.swapColorFormat("ARGB1555")
-        elif current_subtexture_header["Color Format"] == 8:
-            output_bmp.swapColorFormat("ARGB4444")
-        else:
-            output_bmp.swapColorFormat("RGB565")
-
-        if current_subtexture_header["Palette Usage"] == 4:
-            output_bmp.image_header["BPP"] = 8
-            output_bmp.image_header["Color Count"] = 256
-
-            if len(self.palette_list) > 1:
-                palette = self.palette_list[current_subtexture_header["Palette Used"] - 1]
-            else:
-                palette = self.palette_list[0]
+    def get_subtexture_palette(self, texture_id):
+        current_subtexture_header = self.texture_header_list[texture_id]
 
-            output_bmp.color_table_bytes = palette
+        if current_subtexture_header["Palette Usage"] != 4:
+            return None
 
-        return output_bmp
+        if len(self.palette_list) > 1:
+            return self.palette_list[current_subtexture_header["Palette Used"] - 1]
+        return self.palette_list[0]
 
     def convert_bmp_headers_to_texture_header(self, bmp_input):
         sub_texture_header = dict.copy(self.texture_header)
@@ -363,7 +557,7 @@ class RTEX(SR2Texture):
         return sub_texture_header
 
 
-def unyakuza_subtexture(subtexture_bytes) -> bytes:
+def unyakuza_subtexture(subtexture_bytes, fast_unyakuza=True) -> bytes:
     # Mini header
     compression_header = subtexture_bytes[:16]
 
@@ -371,22 +565,120 @@ def unyakuza_subtexture(subtexture_bytes) -> bytes:
         uncompressed_size = int.from_bytes(compression_header[4:8], "little")
         compressed_size = int.from_bytes(compression_header[8:12], "little")
 
-        subtexture_bytes = unyakuza(subtexture_bytes[16:], compressed_size - 16, uncompressed_size)
+        # A 2 byte reference makes at most 18 bytes, anything bigger is a corrupt header, not a huge allocation
+        if compressed_size > len(subtexture_bytes) or uncompressed_size > compressed_size * 9:
+            raise ValueError("Compressed sub-texture is truncated or corrupt")
+
+        # Both give the same output, unyakuza is kept as a reference
+        if fast_unyakuza:
+            decompressor = unyakuza_fast
+        else:
+            decompressor = unyakuza
+
+        subtexture_bytes = decompressor(subtexture_bytes[16:], compressed_size - 16, uncompressed_size)
         subtexture_bytes = bytes(subtexture_bytes)
 
+        # Both give back the compressed data if it runs out before the output is full
+        if len(subtexture_bytes) != uncompressed_size:
+            raise ValueError("Compressed sub-texture is truncated or corrupt")
+
     return subtexture_bytes
 
 
+def yakuza_subtexture(subtexture_bytes, level=6) -> bytes:
+    # Reverse of unyakuza_subtexture, use with "Compressed" = 1
+    compressed_bytes = yakuza(subtexture_bytes, level)
+
+    # Mini header: compression flag, uncompressed size, compressed size with the mini header, unknown
+    compression_header = struct.pack("<4I", 1, len(subtexture_bytes), len(compressed_bytes) + 16, 0)
+
+    return compression_header + compressed_bytes
+
+
+# Smaller MTEX files are faster to decode than to send to a process pool
+MTEX_PARALLEL_UNPACK_THRESHOLD = 0x40000
+
+
+def decode_MTEX_subtexture(texture_header, subtexture_bytes):
+    # Module level, so it can be sent to worker processes
+    if texture_header["Compressed"] == 1:
+        subtexture_bytes = unyakuza_subtexture(subtexture_bytes)
+
+    mtex = MTEX()
+    pixel_bytes = mtex.untwiddle_subtexture(texture_header, subtexture_bytes)
+
+    return pixel_bytes, mtex.tile_list
+
+
+def encode_MTEX_subtexture(texture_header, pixel_bytes, compression_level=6, vq_max_iterations=16, vq_time_budget=None,
+                           tile_codebook=None):
+    # Module level, so it can be sent to worker processes
+    mtex = MTEX()
+    subtexture_bytes = mtex.twiddle_subtexture(texture_header, pixel_bytes, vq_max_iterations, vq_time_budget,
+                                               tile_codebook)
+
+    compressed = 0
+    if texture_header["Compressed"] == 1:
+        compressed_subtexture_bytes = yakuza_subtexture(subtexture_bytes, compression_level)
+
+        # Not worth it otherwise
+        if len(compressed_subtexture_bytes) < len(subtexture_bytes):
+            subtexture_bytes = compressed_subtexture_bytes
+            compressed = 1
+
+    return subtexture_bytes, compressed
+
+
+# (Color Format & 0b11110000) >> 4 of 2 or 8 means twiddled
+MTEX_TWIDDLED = 0x20
+# Anything above 1024 is paletted
+MTEX_PALETTED = 0x800
+
+MTEX_color_converters = {
+    "RGB565": (convertRGB565toRGBA8888, convertRGBA8888toRGB565bytes),
+    "ARGB1555": (convertARGB1555toRGBA8888, convertRGBA8888toARGB1555bytes),
+    "ARGB4444": (convertARGB4444toRGBA8888, convertRGBA8888toARGB4444bytes)
+}
+
+
+def get_MTEX_color_format_name(color_format) -> str:
+    actual_color_format = (color_format & 0b00001111)
+
+    # For one of few textures that needs this exception
+    if color_format == 0:
+        return "ARGB1555"
+
+    if actual_color_format == 2:
+        return "ARGB1555"
+    elif actual_color_format == 8:
+        return "ARGB4444"
+    else:
+        return "RGB565"
+
+
 class MTEX(SR2Texture):
 
-    def __init__(self):
+    def __init__(self, worker_count=1):
         SR2Texture.__init__(self, b'MTEX')
 
+        # Sub-textures are decoded and encoded in a process pool if more than 1
+        self.worker_count = worker_count
+
+        # Used when packing sub-textures with "Compressed" = 1
+        self.compression_level = 6
+
+        # 2x2 tile codebook generation limits, only used when a texture has more than 256 different tiles
+        self.vq_max_iterations = 16
+        self.vq_time_budget = None  # In seconds
+
         self.tile_list = []
         self.index_list = []
         self.palette_list = []
 
-        self.index_counter = 0  # For correct tile unpacking
+        # Per sub-texture: True if its 2x2 tiles go through a 256 entry codebook, False if they're stored as is,
+        # None lets twiddle_subtexture pick the smaller one. Read from the sizes when unpacking, so repacking keeps it
+        self.tile_codebook_list = []
+
         self.unpacked_index_list = []
 
     def MTEX_add_palette_if_present(self, full_header_bytes):
@@ -396,55 +688,60 @@ class MTEX(SR2Texture):
                 self.palette_list.append(palette_bytes)
                 break
 
-    def untwiddle_flat_index_list_into_unpacked_index_list(self, row, column, group_size):
-        if group_size > 1:
-            group_size = group_size // 2
-            self.untwiddle_flat_index_list_into_unpacked_index_list(row, column, group_size)  # Top Left
-            self.untwiddle_flat_index_list_into_unpacked_index_list(row + group_size, column, group_size)  # Bottom Left
-            self.untwiddle_flat_index_list_into_unpacked_index_list(row, column + group_size, group_size)  # Top Right
-            self.untwiddle_flat_index_list_into_unpacked_index_list(row + group_size, column + group_size, group_size)  # Bottom Right
-        elif group_size == 1:
-            self.unpacked_index_list[row][column] = self.index_list[self.index_counter]
-            self.index_counter += 1
-
     # (Un)Twiddling
     def assemble_paletted_pixel_bytes(self):
-        pixel_bytes = b''
-
-        for row in self.unpacked_index_list:
-            for index in row:
-                pixel_bytes += index.to_bytes(1, "little")
+        return self.unpacked_index_list.astype(numpy.uint8).tobytes()
 
-        return pixel_bytes
-
-    def assemble_pixel_bytes_from_tiles(self, individual_tile_list):
-        pixel_bytes = b''
-        # Fill pixel_bytes_list
-        for row in self.unpacked_index_list:
-            # print(row)
-            first_line = b''
-            second_line = b''
-            for index in row:
-                first_line += individual_tile_list[index][:2] + individual_tile_list[index][4:6]
-                second_line += individual_tile_list[index][2:4] + individual_tile_list[index][6:8]
+    def assemble_pixel_bytes_from_tiles(self, tile_array):
+        # tile_array is (N, 2, 2) and stores every tile column by column:
+        # 0 2
+        # 1 3
+        tile_grid = tile_array[self.unpacked_index_list]  # (H/2, W/2, column, row)
 
-            pixel_bytes += first_line
-            pixel_bytes += second_line
+        grid_height, grid_width = self.unpacked_index_list.shape
+        pixel_array = tile_grid.transpose(0, 3, 1, 2).reshape(grid_height * 2, grid_width * 2)
 
-        return pixel_bytes
+        return pixel_array.astype("<u2").tobytes()
 
     def MTEX_split_pixel_bytes_by_sizes_in_header(self, texture_file_bytes):
+        subtexture_location_list = []
+
         subtexture_data_offset = 0x1000
         for texture_header in self.texture_header_list:
             if texture_header["Pixel Offset"] != 0:
                 subtexture_data_offset = texture_header["Pixel Offset"]
 
-            subtexture_bytes = texture_file_bytes[subtexture_data_offset:
-                                                  subtexture_data_offset + texture_header["Image Size (in bytes)"]]
+            subtexture_location_list.append((subtexture_data_offset, texture_header["Image Size (in bytes)"]))
 
             subtexture_data_offset += texture_header["Image Size (in bytes)"]
 
-            self.pixel_bytes_list.append(subtexture_bytes)
+        self.fill_pixel_bytes_list_by_locations(texture_file_bytes, subtexture_location_list)
+        self.MTEX_fill_tile_codebook_list(texture_file_bytes, subtexture_location_list)
+
+    def MTEX_fill_tile_codebook_list(self, texture_file_bytes, subtexture_location_list):
+        # Only needs the sizes (from the mini header if compressed), so lazy unpacking doesn't decode anything for it
+        self.tile_codebook_list = []
+
+        for texture_header, (subtexture_offset, subtexture_size) in zip(self.texture_header_list,
+                                                                        subtexture_location_list):
+            color_format = texture_header["Color Format"]
+            if color_format > 1024 or ((color_format & 0b11110000) >> 4) not in (2, 8):
+                # Paletted and untwiddled sub-textures have no tiles
+                self.tile_codebook_list.append(None)
+                continue
+
+            uncompressed_size = subtexture_size
+            if texture_header["Compressed"] == 1:
+                compression_header = texture_file_bytes[subtexture_offset:subtexture_offset + 16]
+                if int.from_bytes(compression_header[:4], "little") == 1:
+                    uncompressed_size = int.from_bytes(compression_header[4:8], "little")
+
+            # Same check as untwiddle_subtexture
+            self.tile_codebook_list.append(uncompressed_size != texture_header["Image Width"] ** 2 * 2)
+
+    def decode_subtexture(self, texture_index, subtexture_bytes):
+        pixel_bytes, tile_list = decode_MTEX_subtexture(self.texture_header_list[texture_index], subtexture_bytes)
+        return pixel_bytes
 
     def uncompress_compressed_texture_bytes(self):
         for texture_index in range(len(self.texture_header_list)):
@@ -452,6 +749,57 @@ class MTEX(SR2Texture):
             if self.texture_header_list[texture_index]["Compressed"] == 1:
                 self.pixel_bytes_list[texture_index] = unyakuza_subtexture(self.pixel_bytes_list[texture_index])
 
+    def untwiddle_subtexture(self, texture_header, subtexture_bytes):
+        twiddled = ((texture_header["Color Format"] & 0b11110000) >> 4)
+        twiddled = (twiddled == 2) or (twiddled == 8)
+
+        paletted = texture_header["Color Format"] > 1024
+
+        complete_texture_size = texture_header["Image Width"] * texture_header["Image Width"] * 2
+
+        # Fill tile_list and index_list
+        if paletted:
+            # No tiles, palette indexes in their place
+            self.index_list = numpy.frombuffer(subtexture_bytes, dtype=numpy.uint8)
+            tile_bytes = subtexture_bytes
+        elif len(subtexture_bytes) == complete_texture_size:
+            # If it's just compressed, then every 2x2 fragment is a tile and go in sequential order
+            index_amount = (texture_header["Image Width"] // 2) ** 2
+            self.index_list = numpy.arange(index_amount)
+            tile_bytes = subtexture_bytes
+        else:
+            # Regular 256 2x2 tile compression
+            index_bytes_size = ((texture_header["Image Width"] // 2) ** 2)
+            index_bytes = subtexture_bytes[-index_bytes_size:]
+            self.index_list = numpy.frombuffer(index_bytes, dtype=numpy.uint8)
+            tile_bytes = subtexture_bytes[:-index_bytes_size]
+
+        if twiddled:
+
+            if paletted:
+                unpack_index_list_size = texture_header["Image Width"]
+            else:
+                unpack_index_list_size = texture_header["Image Width"] // 2
+
+            # Precomputed Morton order table instead of recursive quadrant unpacking
+            self.unpacked_index_list = untwiddle(self.index_list, unpack_index_list_size)
+
+            if paletted:
+                pixel_bytes = self.assemble_paletted_pixel_bytes()
+            else:
+                # Split tile_bytes into individual 2x2 16 bit tiles
+                tile_count = len(tile_bytes) // 8
+                tile_array = numpy.frombuffer(tile_bytes, dtype="<u2", count=tile_count * 4).reshape(tile_count, 2, 2)
+
+                self.tile_list.append(tile_array)
+
+                pixel_bytes = self.assemble_pixel_bytes_from_tiles(tile_array)
+        else:
+            # Simply compressed and not twiddled, then it's done
+            pixel_bytes = subtexture_bytes
+
+        return pixel_bytes
+
     def unpack_from_bytes(self, texture_file_bytes):
         self.fill_file_header_from_bytes(texture_file_bytes[:self.texture_header_size])
         self.fill_texture_headers_from_bytes(texture_file_bytes[:0x1000])
@@ -460,145 +808,247 @@ class MTEX(SR2Texture):
         # Just split the sub texture bytes
         self.MTEX_split_pixel_bytes_by_sizes_in_header(texture_file_bytes)
 
+        if self.lazy_unpacking:
+            return
+
+        all_subtexture_size = sum(len(subtexture_bytes) for subtexture_bytes in self.pixel_bytes_list)
+
+        if (self.worker_count > 1 and len(self.texture_header_list) > 1
+                and all_subtexture_size >= MTEX_PARALLEL_UNPACK_THRESHOLD):
+            self.unpack_subtextures_in_parallel()
+            return
+
         self.uncompress_compressed_texture_bytes()
 
         # Untwiddle, untile. Idk, make it presentable
         for sub_texture_index in range(len(self.texture_header_list)):
+            self.pixel_bytes_list[sub_texture_index] = self.untwiddle_subtexture(self.texture_header_list[sub_texture_index],
+                                                                                 self.pixel_bytes_list[sub_texture_index])
 
-            texture_header = self.texture_header_list[sub_texture_index]
+    def unpack_subtextures_in_parallel(self):
+        # Memory-mapped sub-textures are memoryviews, which can't be pickled
+        job_list = [(texture_header, bytes(subtexture_bytes))
+                    for texture_header, subtexture_bytes in zip(self.texture_header_list, self.pixel_bytes_list)]
 
-            twiddled = ((texture_header["Color Format"] & 0b11110000) >> 4)
-            twiddled = (twiddled == 2) or (twiddled == 8)
+        with multiprocessing.Pool(min(self.worker_count, len(job_list))) as pool:
+            # starmap keeps the results in sub-texture order
+            result_list = pool.starmap(decode_MTEX_subtexture, job_list)
 
-            paletted = texture_header["Color Format"] > 1024
+        for sub_texture_index in range(len(result_list)):
+            pixel_bytes, tile_list = result_list[sub_texture_index]
+            self.pixel_bytes_list[sub_texture_index] = pixel_bytes
+            self.tile_list += tile_list
 
-            subtexture_bytes = self.pixel_bytes_list[sub_texture_index]
+    def add_texture(self, generic_texture_header, pixel_bytes, tile_codebook=None):
+        # tile_codebook: see tile_codebook_list
+        self.texture_header_list.append(generic_texture_header)
+        self.pixel_bytes_list.append(pixel_bytes)
+        self.tile_codebook_list.append(tile_codebook)
+        self.file_header["Texture Count"] += 1
 
-            complete_texture_size = texture_header["Image Width"] * texture_header["Image Width"] * 2
+    def build_tile_codebook(self, tile_array, color_format_name, max_iterations=16, time_budget=None):
+        # tile_array is (N, 4), returns a (256, 4) codebook and an index for every tile
+        unique_tile_array, tile_inverse_array = numpy.unique(tile_array, axis=0, return_inverse=True)
+        tile_inverse_array = tile_inverse_array.reshape(-1)
 
-            # Fill tile_list and index_list
-            if paletted:
-                # No tiles, palette indexes in their place
-                self.index_list = list.copy([subtexture_bytes[index] for index in range(len(subtexture_bytes))])
-                tile_bytes = subtexture_bytes
-            elif len(subtexture_bytes) == complete_texture_size:
-                # If it's just compressed, then every 2x2 fragment is a tile and go in sequential order
-                index_amount = (texture_header["Image Width"] // 2) ** 2
-                self.index_list = list.copy([i for i in range(index_amount)])
-                tile_bytes = subtexture_bytes
-            else:
-                # Regular 256 2x2 tile compression
-                index_bytes_size = ((texture_header["Image Width"] // 2) ** 2)
-                index_bytes = subtexture_bytes[-index_bytes_size:]
-                self.index_list = list.copy([index_bytes[i] for i in range(index_bytes_size)])
-                tile_bytes = subtexture_bytes[:-index_bytes_size]
+        codebook = numpy.zeros((256, 4), dtype=numpy.uint16)
 
-            if twiddled:
+        # Lossless if the texture doesn't have more than 256 different tiles
+        if len(unique_tile_array) <= 256:
+            codebook[:len(unique_tile_array)] = unique_tile_array
+            return codebook, tile_inverse_array
 
-                if paletted:
-                    unpack_index_list_size = texture_header["Image Width"]
-                else:
-                    unpack_index_list_size = texture_header["Image Width"] // 2
+        # Otherwise k-means on RGBA8888 colors, 4 pixels per tile
+        convert_to_rgba8888, convert_from_rgba8888 = MTEX_color_converters[color_format_name]
 
-                self.unpacked_index_list = [[0 for x in range(unpack_index_list_size)]
-                                               for y in range(unpack_index_list_size)]
+        unique_tile_rgba_array = convert_to_rgba8888(unique_tile_array.astype("<u2").tobytes()).reshape(-1, 16)
+        unique_tile_count_array = numpy.bincount(tile_inverse_array)
 
-                self.index_counter = 0
-                self.untwiddle_flat_index_list_into_unpacked_index_list(0, 0, unpack_index_list_size)
+        codebook_rgba_array = build_vq_codebook(unique_tile_rgba_array, unique_tile_count_array, 256,
+                                                max_iterations, time_budget)
 
-                if paletted:
-                    pixel_bytes = self.assemble_paletted_pixel_bytes()
-                else:
-                    # Split tile_bytes into individual 2x2 16 bit tiles
-                    individual_tile_list = [tile_bytes[index * 8:index * 8 + 8] for index in range(len(tile_bytes) // 8)]
+        codebook_rgba_array = numpy.clip(numpy.rint(codebook_rgba_array), 0, 255).astype(numpy.uint8)
+        codebook_bytes = convert_from_rgba8888(codebook_rgba_array.reshape(256 * 4, 1, 4))
+        codebook[:] = numpy.frombuffer(codebook_bytes, dtype="<u2").reshape(256, 4)
 
-                    self.tile_list.append(individual_tile_list)
+        # Match tiles against the colors that will actually be stored
+        stored_codebook_rgba_array = convert_to_rgba8888(codebook_bytes).reshape(256, 16)
+        unique_tile_index_array = find_nearest_codebook_entries(unique_tile_rgba_array, stored_codebook_rgba_array)
 
-                    pixel_bytes = self.assemble_pixel_bytes_from_tiles(individual_tile_list)
-            else:
-                # Simply compressed and not twiddled, then it's done
-                pixel_bytes = subtexture_bytes
+        return codebook, unique_tile_index_array[tile_inverse_array]
 
-            self.pixel_bytes_list[sub_texture_index] = pixel_bytes
+    def twiddle_subtexture(self, texture_header, pixel_bytes, vq_max_iterations=16, vq_time_budget=None,
+                           tile_codebook=None):
+        # Reverse of untwiddle_subtexture, tile_codebook: see tile_codebook_list
+        twiddled = ((texture_header["Color Format"] & 0b11110000) >> 4)
+        twiddled = (twiddled == 2) or (twiddled == 8)
 
-    def add_texture(self, generic_texture_header, pixel_bytes):
-        self.texture_header_list.append(generic_texture_header)
-        self.pixel_bytes_list.append(pixel_bytes)
-        self.file_header["Texture Count"] += 1
+        paletted = texture_header["Color Format"] > 1024
 
-    def pack_and_return(self):
-        file_header_bytes = self.pack_file_header()
-        texture_header_bytes = self.pack_texture_headers()
-        padding_bytes = self.pack_padding()
+        image_width = texture_header["Image Width"]
 
-        all_pixel_bytes = self.pack_pixel_bytes()
+        if not twiddled:
+            return bytes(pixel_bytes)
 
-        return file_header_bytes + texture_header_bytes + padding_bytes + all_pixel_bytes
+        if paletted:
+            index_array = numpy.frombuffer(pixel_bytes, dtype=numpy.uint8, count=image_width * image_width)
+            return twiddle(index_array.reshape(image_width, image_width), image_width).tobytes()
 
-    def setup_bmp(self, texture_id):
-        current_subtexture_header = self.texture_header_list[texture_id]
-        output_bmp = BMPv5()
+        tile_grid_size = image_width // 2
 
-        output_bmp.set_resolution(current_subtexture_header["Image Width"],
-                                  current_subtexture_header["Image Width"])
+        # (H/2, row, W/2, column) -> (H/2, W/2, column, row), the tile layout assemble_pixel_bytes_from_tiles reads
+        pixel_array = numpy.frombuffer(pixel_bytes, dtype="<u2", count=image_width * image_width)
+        tile_array = pixel_array.reshape(tile_grid_size, 2, tile_grid_size, 2).transpose(0, 2, 3, 1)
+        tile_array = tile_array.reshape(tile_grid_size * tile_grid_size, 4)
 
-        paletted = current_subtexture_header["Color Format"] > 1024
+        # Small textures are smaller without a codebook, every tile is stored as is
+        if tile_codebook is None:
+            tile_codebook = 2048 + tile_grid_size * tile_grid_size < image_width * image_width * 2
+        if not tile_codebook:
+            return twiddle(tile_array, tile_grid_size).astype("<u2").tobytes()
 
-        actual_color_format = (current_subtexture_header["Color Format"] & 0b00001111)
+        codebook, index_array = self.build_tile_codebook(tile_array,
+                                                         get_MTEX_color_format_name(texture_header["Color Format"]),
+                                                         vq_max_iterations, vq_time_budget)
 
-        if not paletted:
-            output_bmp.image_header["BPP"] = 16
-            if actual_color_format == 2:
-                output_bmp.swapColorFormat("ARGB1555")
-            elif actual_color_format == 8:
-                output_bmp.swapColorFormat("ARGB4444")
-            else:
-                output_bmp.swapColorFormat("RGB565")
+        twiddled_index_array = twiddle(index_array, tile_grid_size).astype(numpy.uint8)
 
-            # For one of few textures that needs this exception
-            if current_subtexture_header["Color Format"] == 0:
-                output_bmp.swapColorFormat("ARGB1555")
-        else:
-            output_bmp.color_table_bytes = self.palette_list[0]
-            output_bmp.image_header["BPP"] = 8
-            output_bmp.image_header["Color Count"] = 256
+        return codebook.astype("<u2").tobytes() + twiddled_index_array.tobytes()
 
+    def pack_subtextures(self):
+        job_list = [(self.texture_header_list[i], self.pixel_bytes_list[i],
+                     self.compression_level, self.vq_max_iterations, self.vq_time_budget,
+                     self.tile_codebook_list[i] if i < len(self.tile_codebook_list) else None)
+                    for i in range(len(self.texture_header_list))]
 
-        return output_bmp
+        all_pixel_size = sum(len(pixel_bytes) for pixel_bytes in self.pixel_bytes_list)
 
-    def convert_bmp_headers_to_texture_header(self, bmp_input):
-        raise LookupError("MTEX textures can't be made from bmps")
-        sub_texture_header = dict.copy(self.texture_header)
+        if self.worker_count > 1 and len(job_list) > 1 and all_pixel_size >= MTEX_PARALLEL_UNPACK_THRESHOLD:
+            # Pixels read from BMPs are memoryviews, which can't be pickled
+            job_list = [(job[0], bytes(job[1])) + job[2:] for job in job_list]
+            with multiprocessing.Pool(min(self.worker_count, len(job_list))) as pool:
+                return pool.starmap(encode_MTEX_subtexture, job_list)
 
-        sub_texture_header["Image Width"] = bmp_input.image_header["Image Width"]
-        sub_texture_header["Image Size (in bytes)"] = len(bmp_input.pixel_bytes)
+        return [encode_MTEX_subtexture(*job) for job in job_list]
+
+    def pack_and_return(self):
+        # pixel_bytes_list holds untwiddled pixels, so everything gets twiddled and compressed again
+        encoded_subtexture_list = self.pack_subtextures()
+
+        subtexture_data_offset = 0x1000
+        for texture_header, (subtexture_bytes, compressed) in zip(self.texture_header_list, encoded_subtexture_list):
+            texture_header["Compressed"] = compressed
+            texture_header["Pixel Offset"] = subtexture_data_offset
+            texture_header["Image Size (in bytes)"] = len(subtexture_bytes)
+            subtexture_data_offset += len(subtexture_bytes)
+
+        self.file_header["Texture Count"] = len(self.texture_header_list)
+
+        header_bytes = self.pack_file_header() + self.pack_texture_headers()
+
+        # Palette always sits at 0x400, right where MTEX_add_palette_if_present reads it
+        if len(self.palette_list) > 0:
+            if len(header_bytes) > 0x400:
+                raise ValueError("Too many sub-textures to fit a palette into the MTEX header")
+            header_bytes = header_bytes.ljust(0x400, b'\x00') + self.palette_list[0]
+
+        if len(header_bytes) > 0x1000:
+            raise ValueError("Too many sub-textures to fit into the MTEX header")
+        header_bytes = header_bytes.ljust(0x1000, b'\x00')
+
+        return header_bytes + b''.join(subtexture_bytes for subtexture_bytes, compressed in encoded_subtexture_list)
+
+    def get_subtexture_color_format(self, texture_id) -> str:
+        color_format = self.texture_header_list[texture_id]["Color Format"]
+
+        # Paletted sub-textures keep the default BMP masks, so index 0 isn't transparent
+        if color_format > 1024:
+            return "RGB565"
+        return get_MTEX_color_format_name(color_format)
+
+    def get_subtexture_palette(self, texture_id):
+        if self.texture_header_list[texture_id]["Color Format"] > 1024:
+            return self.palette_list[0]
+        return None
+
+    def convert_bmp_headers_to_texture_header(self, bmp_input, source_texture_header=None):
+        """
+        source_texture_header: header of the sub-texture this image replaces, its Color Format (with the twiddle
+        and palette bits) and Compressed are kept if the image has the same color format
+        New sub-textures are twiddled and compressed
+        """
+        sub_texture_header = dict.copy(self.texture_header)
 
         # Color Format
-        if bmp_input.image_header["BPP"] > 16:
-            raise TypeError("Only 16 bit textures are supported (RGB565, ARGB1555 or ARGB4444)")
+        if bmp_input.image_header["BPP"] > 16 or bmp_input.image_header["BPP"] < 8:
+            raise TypeError("Only 16 bit textures are supported (RGB565, ARGB1555 or ARGB4444) or paletted 8bit")
 
         bmp_color_format = bmp_input.check_color_format()
+        paletted = len(bmp_input.color_table_bytes) > 0
 
         match bmp_color_format:
             case "RGB565":
-                sub_texture_header["Color Format"] = 0
+                sub_texture_header["Color Format"] = MTEX_TWIDDLED | 0
             case "ARGB1555":
-                sub_texture_header["Color Format"] = 2
+                sub_texture_header["Color Format"] = MTEX_TWIDDLED | 2
             case "ARGB4444":
-                sub_texture_header["Color Format"] = 8
+                sub_texture_header["Color Format"] = MTEX_TWIDDLED | 8
+            case "Palette" if paletted:
+                sub_texture_header["Color Format"] = MTEX_TWIDDLED
             case _:
                 raise TypeError("Incorrect color format, save BMP as RGB565, ARGB1555 or ARGB4444")
 
+        # MTEX has room for a single palette
+        if paletted:
+            sub_texture_header["Color Format"] |= MTEX_PALETTED
+
+            if len(self.palette_list) == 0:
+                self.palette_list.append(bmp_input.color_table_bytes)
+            elif self.palette_list[0] != bmp_input.color_table_bytes:
+                raise ValueError("All paletted sub-textures of an MTEX have to use the same palette")
+
+        sub_texture_header["Compressed"] = 1  # Dropped when packing if it doesn't make it smaller
+
+        if source_texture_header is not None:
+            source_color_format = source_texture_header["Color Format"]
+            if source_color_format > 1024:
+                same_color_format = paletted
+            else:
+                same_color_format = not paletted and bmp_color_format == get_MTEX_color_format_name(source_color_format)
+
+            if same_color_format:
+                sub_texture_header["Color Format"] = source_color_format
+                sub_texture_header["Compressed"] = source_texture_header["Compressed"]
+
+        image_width = bmp_input.image_header["Image Width"]
+        if image_width != abs(bmp_input.image_header["Image Height"]):
+            raise ValueError("MTEX textures have to be square")
+
+        # Untwiddled sub-textures are stored row by row, only twiddling needs a power of 2
+        twiddled = ((sub_texture_header["Color Format"] & 0b11110000) >> 4) in (2, 8)
+        if twiddled and image_width & (image_width - 1) != 0:
+            raise ValueError("Twiddled MTEX textures have to be a power of 2 size")
+
+        sub_texture_header["Image Width"] = image_width
+        sub_texture_header["Image Size (in bytes)"] = len(bmp_input.pixel_bytes)  # Updated when packing
+
         return sub_texture_header
 
 
 class RTXR(SR2Texture):
     def __init__(self):
         SR2Texture.__init__(self, b'RTXR')
-        # Uses unknown compression
+        # Compression isn't documented and there are no samples to check against, so RTXR is refused.
+        # True tries Yakuza LZ, only streams that decode to exactly the expected size from exactly
+        # the stored bytes are accepted
+        self.yakuza_decoding = False
+
+        # Packed back as is, pixel_bytes_list holds the uncompressed pixels
+        self.compressed_pixel_bytes_list = []
 
     def RTXR_fill_texture_header_list_and_split_compressed_pixel_bytes(self, texture_file_bytes):
         texture_offset = self.file_header_size
+        subtexture_location_list = []
         # Fill texture_header_list and pixel_bytes_list
         # texture headers and pixel bytes are stored in pairs RIGHT after each other
         for i in range(self.file_header["Texture Count"]):
@@ -608,42 +1058,64 @@ class RTXR(SR2Texture):
                                                                 self.texture_header_formatting)
             # dict.copy, because python uses a reference when it doesn't need to
             self.texture_header_list.append(dict.copy(texture_header))
-            print(texture_header)
 
             texture_offset += self.texture_header_size
 
-            texture_bytes = texture_file_bytes[texture_offset:
-                                               texture_offset + texture_header["Image Size (in bytes)"]]
-            self.pixel_bytes_list.append(texture_bytes)
+            subtexture_location_list.append((texture_offset, texture_header["Image Size (in bytes)"]))
 
             texture_offset += texture_header["Image Size (in bytes)"]
 
-    '''
+        # Compressed bytes are packed back as is
+        self.compressed_pixel_bytes_list = LazyPixelBytesList(texture_file_bytes, subtexture_location_list)
+        if not self.lazy_unpacking:
+            self.compressed_pixel_bytes_list = list(self.compressed_pixel_bytes_list)
+
+        self.fill_pixel_bytes_list_by_locations(texture_file_bytes, subtexture_location_list)
+
     def RTXR_unyakuza_subtexture(self, texture_header, subtexture_bytes) -> bytes:
 
+        if not self.yakuza_decoding:
+            raise ValueError("Can't uncompress RTXR sub-texture, compression isn't supported")
+
         uncompressed_size = texture_header["Image Width"] * texture_header["Image Height"] * 2
         compressed_size = texture_header["Image Size (in bytes)"]
 
-        subtexture_bytes = unyakuza(subtexture_bytes, compressed_size, uncompressed_size)
-        subtexture_bytes = bytes(subtexture_bytes)
+        # Stored as is
+        if compressed_size == uncompressed_size:
+            return subtexture_bytes
 
-        return subtexture_bytes
-    '''
+        compression_header = subtexture_bytes[:16]
+        if (int.from_bytes(compression_header[:4], "little") == 1
+                and int.from_bytes(compression_header[4:8], "little") == uncompressed_size
+                and int.from_bytes(compression_header[8:12], "little") == compressed_size):
+            # Same mini header as MTEX sub-textures
+            subtexture_bytes = subtexture_bytes[16:]
+            compressed_size -= 16
+
+        try:
+            return bytes(unyakuza_checked(subtexture_bytes, compressed_size, uncompressed_size))
+        except ValueError as error:
+            raise ValueError("Can't uncompress RTXR sub-texture, " + str(error)[0].lower() + str(error)[1:])
+
+    def decode_subtexture(self, texture_index, subtexture_bytes):
+        return self.RTXR_unyakuza_subtexture(self.texture_header_list[texture_index], subtexture_bytes)
 
     def uncompress_pixel_bytes(self):
         for texture_index in range(len(self.texture_header_list)):
             texture_header = self.texture_header_list[texture_index]
             subtexture_bytes = self.pixel_bytes_list[texture_index]
 
-            # self.pixel_bytes_list[texture_index] = self.RTXR_unyakuza_subtexture(texture_header, subtexture_bytes)
+            self.pixel_bytes_list[texture_index] = self.RTXR_unyakuza_subtexture(texture_header, subtexture_bytes)
 
     def unpack_from_bytes(self, texture_file_bytes):
         self.fill_file_header_from_bytes(texture_file_bytes)
         self.RTXR_fill_texture_header_list_and_split_compressed_pixel_bytes(texture_file_bytes)
 
-        # Needs different decompression code
-        self.uncompress_pixel_bytes()
+        if not self.lazy_unpacking:
+            self.uncompress_pixel_bytes()
 
+    def get_subtexture_color_format(self, texture_id) -> str:
+        return get_RTEX_color_format_name(self.texture_header_list[texture_id]["Color Format"])
 
     def pack_and_return(self):
         # Texture Header and Compressed Pixel Bytes are stored in pairs
@@ -654,8 +1126,56 @@ class RTXR(SR2Texture):
         for i in range(len(self.texture_header_list)):
             texture_header_bytes = struct.pack(self.texture_header_formatting,
                                                           *self.texture_header_list[i].values())
-            compressed_pixel_bytes = self.pixel_bytes_list[i]
+            compressed_pixel_bytes = self.compressed_pixel_bytes_list[i]
 
             texture_header_and_pixel_bytes += (texture_header_bytes + compressed_pixel_bytes)
 
         return file_header_bytes + texture_header_and_pixel_bytes
+
+
+def benchmark_MTEX_tile_assembly(tile_grid_size=512, repeat_count=3):
+    import random
+    import time
+
+    # Row by row bytes concatenation, as MTEX used to do it
+    def assemble_pixel_bytes_from_tiles_by_rows(unpacked_index_list, individual_tile_list):
+        pixel_bytes = b''
+        for row in unpacked_index_list:
+            first_line = b''
+            second_line = b''
+            for index in row:
+                first_line += individual_tile_list[index][:2] + individual_tile_list[index][4:6]
+                second_line += individual_tile_list[index][2:4] + individual_tile_list[index][6:8]
+            pixel_bytes += first_line
+            pixel_bytes += second_line
+        return pixel_bytes
+
+    random.seed(0)
+    tile_bytes = bytes(random.getrandbits(8) for _ in range(2048))
+    index_bytes = bytes(random.getrandbits(8) for _ in range(tile_grid_size ** 2))
+
+    mtex = MTEX()
+    mtex.unpacked_index_list = untwiddle(numpy.frombuffer(index_bytes, dtype=numpy.uint8), tile_grid_size)
+    tile_array = numpy.frombuffer(tile_bytes, dtype="<u2").reshape(256, 2, 2)
+
+    individual_tile_list = [tile_bytes[index * 8:index * 8 + 8] for index in range(256)]
+    unpacked_index_list = mtex.unpacked_index_list.tolist()
+
+    start_time = time.perf_counter()
+    for _ in range(repeat_count):
+        old_pixel_bytes = assemble_pixel_bytes_from_tiles_by_rows(unpacked_index_list, individual_tile_list)
+    old_time = (time.perf_counter() - start_time) / repeat_count
+
+    start_time = time.perf_counter()
+    for _ in range(repeat_count):
+        new_pixel_bytes = mtex.assemble_pixel_bytes_from_tiles(tile_array)
+    new_time = (time.perf_counter() - start_time) / repeat_count
+
+    if old_pixel_bytes != new_pixel_bytes:
+        raise ValueError("Tile assembly results don't match")
+
+    print("{0}x{0} tile grid assembly: rows {1:.4f} s, array {2:.4f} s".format(tile_grid_size, old_time, new_time))
+
+
+if __name__ == "__main__":
+    benchmark_MTEX_tile_assembly()
@@ -1,15 +1,23 @@
 # Texture converter
+import collections
+import contextlib
+import io
+import multiprocessing
 import os
+import shutil
+import struct
+import time
 from texture_classes import *
 from PIL import Image
 import numpy
 import bmp_png_conversion
+import color_conversion
+from rebuild_cache import get_bytes_hash
+from file_index import FILE_HEADER_READ_SIZE, classify_file_header, get_file_type, texture_file_types
 
 
-def detect_texture_type(input_texture_path: str):
-    with open(input_texture_path, 'r+b') as f:
-        file_signature = f.read(4)
-
+def create_texture_by_signature(file_signature: bytes, rtxr_yakuza_decoding=False):
+    # rtxr_yakuza_decoding: try Yakuza LZ on RTXR sub-textures instead of refusing them (see RTXR.yakuza_decoding)
     match file_signature:
         case b'RTEX':
             input_texture = RTEX()
@@ -17,6 +25,7 @@ def detect_texture_type(input_texture_path: str):
             input_texture = RHBG()
         case b'RTXR':
             input_texture = RTXR()
+            input_texture.yakuza_decoding = rtxr_yakuza_decoding
         case b'MTEX':
             input_texture = MTEX()
         case _:
@@ -25,9 +34,16 @@ def detect_texture_type(input_texture_path: str):
     return input_texture
 
 
-def convertTXRtoBMPlist(input_texture_path: str) -> list:
+def detect_texture_type(input_texture_path: str, rtxr_yakuza_decoding=False):
+    with open(input_texture_path, 'r+b') as f:
+        file_signature = f.read(4)
+
+    return create_texture_by_signature(file_signature, rtxr_yakuza_decoding)
+
+
+def convertTXRtoBMPlist(input_texture_path: str, rtxr_yakuza_decoding=False) -> list:
     output_bmp_list = []
-    input_texture = detect_texture_type(input_texture_path)
+    input_texture = detect_texture_type(input_texture_path, rtxr_yakuza_decoding)
     input_texture.unpack_from_file(input_texture_path)
 
     for texture_id in range(len(input_texture.texture_header_list)):
@@ -47,7 +63,28 @@ def convertTXRtoBMPlist(input_texture_path: str) -> list:
 
 
 # With smart path system
-def convertTXRtoBMP(input_path, output_path, png_export=False):
+def get_TXR_export_path(texture_path, output_path) -> str:
+    # Output path without the ".N.bmp" / ".N.png" sub-texture suffix
+    bmp_path = output_path
+
+    if not output_path:
+        bmp_path = texture_path
+    elif os.path.isdir(output_path) or output_path[output_path.rfind("."):] != ".bmp":
+        texture_path_file_title = texture_path[texture_path.rfind("/") + 1:]
+        bmp_path = output_path + texture_path_file_title
+
+    return bmp_path
+
+
+def convertTXRtoBMP(input_path, output_path, png_export=False, buffer_pool=None, png_preset="default",
+                    png_compress_level=None, png_optimize=None, rtxr_yakuza_decoding=False):
+    """
+    png_preset is "default", "fast" or "small" (see bmp_png_conversion.png_save_presets),
+    png_compress_level and png_optimize override it
+    rtxr_yakuza_decoding tries Yakuza LZ on RTXR files, otherwise they're skipped
+    For whole directory trees batchConvertTXRtoBMP is a lot faster
+    """
+    png_save_options = bmp_png_conversion.get_png_save_options(png_preset, png_compress_level, png_optimize)
 
     if input_path == "":
         raise ValueError("Invalid input_path")
@@ -71,45 +108,353 @@ def convertTXRtoBMP(input_path, output_path, png_export=False):
     for texture_path in input_texture_list:
 
         # Set up output file name
-        bmp_path = output_path
-
-        if not output_path:
-            bmp_path = texture_path
-        elif os.path.isdir(output_path) or output_path[output_path.rfind("."):] != ".bmp":
-            texture_path_file_title = texture_path[texture_path.rfind("/") + 1:]
-            bmp_path = output_path + texture_path_file_title
-            os.makedirs(os.path.dirname(bmp_path), exist_ok=True)
+        bmp_path = get_TXR_export_path(texture_path, output_path)
 
-        file_signature = open(texture_path, "rb").read(4)
+        # The file is opened once, its type comes from the mapped header bytes
+        # Outputs never overwrite the input here, so pixel bytes can stay in the mapped file until saved
+        try:
+            texture_file_bytes = map_file_as_memoryview(texture_path)
+        except OSError as error:
+            print("Can't read the file: " + (error.strerror or str(error)) + ": " + texture_path)
+            continue
 
-        if ((file_signature != b'RTEX' and file_signature != b'RHBG' and file_signature != b'MTEX')
-                or (texture_path[-4:] == ".BIN" or texture_path[-4:] == ".bin")):
+        # .BIN archives are classified as BIN even if they start like a texture
+        if classify_file_header(os.path.basename(texture_path), len(texture_file_bytes),
+                                texture_file_bytes[:FILE_HEADER_READ_SIZE]) not in texture_file_types:
             print("Not a texture file / Can't be exported")
             continue
 
-        input_texture_file = detect_texture_type(texture_path)
-        input_texture_file.unpack_from_file(texture_path)
+        input_texture_file = create_texture_by_signature(bytes(texture_file_bytes[:4]), rtxr_yakuza_decoding)
+        try:
+            input_texture_file.unpack_from_bytes(texture_file_bytes)
+        except (ValueError, struct.error) as error:
+            # RTXR sub-textures that don't decode or a cut off file
+            print(str(error) + ": " + texture_path)
+            continue
 
         for subtexture_id in range(len(input_texture_file.texture_header_list)):
 
-            output_bmp = input_texture_file.setup_bmp(subtexture_id)
-
-            output_bmp.pixel_bytes = input_texture_file.pixel_bytes_list[subtexture_id]
-
             bmp_formated_path = bmp_path + '.{}.bmp'.format(subtexture_id)
 
             os.makedirs(os.path.dirname(bmp_formated_path), exist_ok=True)
 
             if png_export:
                 png_formated_path = bmp_formated_path[:-3] + "png"
-                png = bmp_png_conversion.BMPtoPNG(output_bmp)
-                png.save(png_formated_path)
+                # Straight from the texture header, no BMP in between
+                # PNG is saved right away, so the pooled buffer can be reused by the next sub-texture
+                png = bmp_png_conversion.SubtextureToPNG(input_texture_file, subtexture_id, buffer_pool)
+                png.save(png_formated_path, **png_save_options)
                 print("Saved " + png_formated_path)
             else:
+                output_bmp = input_texture_file.setup_bmp(subtexture_id)
+                output_bmp.pixel_bytes = input_texture_file.pixel_bytes_list[subtexture_id]
                 output_bmp.save(bmp_formated_path)
                 print("Saved " + bmp_formated_path)
 
 
+# One per process, PNGs are encoded right after conversion so the buffers can be reused
+export_buffer_pool = color_conversion.ConversionBufferPool()
+
+
+def get_subtexture_export_path(bmp_path, subtexture_id, png_export=False) -> str:
+    # ./folder/input.txr + 0 -> ./folder/input.txr.0.bmp
+    if png_export:
+        return bmp_path + '.{}.png'.format(subtexture_id)
+    return bmp_path + '.{}.bmp'.format(subtexture_id)
+
+
+def hashTXRfileSubtextures(texture_path, rtxr_yakuza_decoding=False):
+    """
+    First pass of a deduplicated batch export, nothing is decoded
+    Returns ([stored payload hash of every sub-texture], error message or None, texture file hash or None)
+    Module level, so batchConvertTXRtoBMP can run it in worker processes
+    """
+    try:
+        with open(texture_path, "rb") as texture_file:
+            texture_file_bytes = texture_file.read()
+    except OSError as error:
+        # Deleted or locked since the file list was made, there's no hash without the bytes
+        return [], "Can't read the file: " + (error.strerror or str(error)), None
+    texture_file_hash = get_bytes_hash(texture_file_bytes)
+
+    try:
+        input_texture_file = create_texture_by_signature(texture_file_bytes[:4], rtxr_yakuza_decoding)
+        input_texture_file.lazy_unpacking = True
+        input_texture_file.unpack_from_bytes(texture_file_bytes)
+    except (ValueError, struct.error) as error:
+        # Not a texture or a cut off file, sub-textures that don't decode are only found when exporting them
+        return [], str(error), texture_file_hash
+
+    return ([input_texture_file.get_subtexture_stored_payload_hash(subtexture_id)
+             for subtexture_id in range(len(input_texture_file.texture_header_list))], None, texture_file_hash)
+
+
+def exportTXRfileToBuffers(texture_path, bmp_path, png_export=False, png_save_options=None, subtexture_id_list=None,
+                           rtxr_yakuza_decoding=False):
+    """
+    Reads the texture file once, decodes it and encodes sub-textures into BMP or PNG file bytes
+    subtexture_id_list: only these sub-textures are decoded and encoded, None - all of them
+    Returns ([(sub-texture id, output path, file bytes, seconds it took)], error message or None,
+             seconds it took, texture file hash)
+    The file hash comes from the bytes read here, so the rebuild manifest doesn't read the file again
+    Module level, so batchConvertTXRtoBMP can run it in worker processes
+    """
+    start_time = time.perf_counter()
+
+    if png_save_options is None:
+        png_save_options = bmp_png_conversion.get_png_save_options()
+
+    try:
+        with open(texture_path, "rb") as texture_file:
+            texture_file_bytes = texture_file.read()
+    except OSError as error:
+        # Deleted or locked since the file list was made, there's no hash without the bytes
+        error_message = "Can't read the file: " + (error.strerror or str(error))
+        return [], error_message, time.perf_counter() - start_time, None
+    texture_file_hash = get_bytes_hash(texture_file_bytes)
+
+    output_file_list = []
+
+    try:
+        input_texture_file = create_texture_by_signature(texture_file_bytes[:4], rtxr_yakuza_decoding)
+        # Sub-textures that aren't exported are never decoded
+        input_texture_file.lazy_unpacking = subtexture_id_list is not None
+        input_texture_file.unpack_from_bytes(texture_file_bytes)
+
+        if subtexture_id_list is None:
+            subtexture_id_list = range(len(input_texture_file.texture_header_list))
+
+        for subtexture_id in subtexture_id_list:
+            subtexture_start_time = time.perf_counter()
+
+            if png_export:
+                png_file = io.BytesIO()
+                png = bmp_png_conversion.SubtextureToPNG(input_texture_file, subtexture_id, export_buffer_pool)
+                png.save(png_file, format="PNG", **png_save_options)
+                output_file_bytes = png_file.getvalue()
+            else:
+                output_bmp = input_texture_file.setup_bmp(subtexture_id)
+                output_bmp.pixel_bytes = input_texture_file.pixel_bytes_list[subtexture_id]
+                output_file_bytes = output_bmp.pack_and_return()
+
+            output_file_list.append((subtexture_id, get_subtexture_export_path(bmp_path, subtexture_id, png_export),
+                                     output_file_bytes, time.perf_counter() - subtexture_start_time))
+    except (ValueError, struct.error) as error:
+        # Not a texture, RTXR sub-textures that don't decode, corrupt compressed data or a cut off file
+        return [], str(error), time.perf_counter() - start_time, texture_file_hash
+
+    return output_file_list, None, time.perf_counter() - start_time, texture_file_hash
+
+
+def writeExportedFile(output_file_path, output_file_bytes):
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    # Unlinked first, the old file can be a hardlink shared with other outputs
+    if os.path.lexists(output_file_path):
+        os.remove(output_file_path)
+    with open(output_file_path, "wb") as output_file:
+        output_file.write(output_file_bytes)
+
+
+def linkExportedFile(source_file_path, output_file_path) -> bool:
+    # Hardlinks output_file_path to an already written file, copies it if the file system can't link
+    # False if it was copied
+    if output_file_path == source_file_path:
+        return True
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    if os.path.lexists(output_file_path):
+        os.remove(output_file_path)
+    try:
+        os.link(source_file_path, output_file_path)
+    except OSError:
+        shutil.copyfile(source_file_path, output_file_path)
+        return False
+    return True
+
+
+def batchConvertTXRtoBMP(input_texture_list, output_path, png_export=False, png_preset="default",
+                         worker_count=None, output_queue_size=None, rebuild_manifest=None, deduplicate=False,
+                         png_compress_level=None, png_optimize=None, rtxr_yakuza_decoding=False):
+    """
+    convertTXRtoBMP for a list of files, with the same output naming and PNG options
+    Files are read once, decoded and encoded by worker_count processes (all cores if None, 1 - no pool)
+    Outputs are written by this process, at most output_queue_size files wait to be written at a time
+    rebuild_manifest (rebuild_cache.RebuildManifest) skips files exported before that didn't change since
+    deduplicate: workers first hash the sub-textures as stored (same stored bytes, header and palette),
+    this process hands each one out to be decoded and encoded once and hardlinks the repeats to the first output,
+    so editing one of them in place edits all of them. Files with repeats get read twice. Off by default,
+    every output is its own file then
+    rtxr_yakuza_decoding: see convertTXRtoBMP, RTXR files refused before are exported again once it's turned on
+    """
+    png_save_options = bmp_png_conversion.get_png_save_options(png_preset, png_compress_level, png_optimize)
+    export_settings = {"PNG Export": png_export, "PNG Save Options": png_save_options,
+                       "RTXR Yakuza Decoding": rtxr_yakuza_decoding}
+
+    export_texture_list = []
+    skipped_file_count = 0
+    for texture_path in input_texture_list:
+        # B_CARTEX.BIN and friends aren't textures even if they start like one
+        if texture_path[-4:] == ".BIN" or texture_path[-4:] == ".bin":
+            continue
+        if rebuild_manifest is not None and rebuild_manifest.is_up_to_date(texture_path, [texture_path],
+                                                                           export_settings):
+            skipped_file_count += 1
+            continue
+        export_texture_list.append(texture_path)
+
+    # Exports go into one folder by file name, so a/x.txr and b/x.txr write the same files
+    export_path_count = collections.Counter(get_TXR_export_path(texture_path, output_path)
+                                            for texture_path in export_texture_list)
+
+    # Stored payload hash: texture path that decodes and encodes it
+    claimed_payload_dict = {}
+    # Stored payload hash: (written path, byte count, seconds it took to make)
+    written_payload_dict = {}
+    exported_file_hash_set = set()
+
+    subtexture_count = 0
+    duplicate_file_count = 0
+    linked_file_count = 0
+    linked_byte_count = 0
+    saved_seconds = 0.0
+
+    def write_export(texture_path, payload_hash_list, output_file_list, error_message, export_seconds,
+                     texture_file_hash):
+        nonlocal subtexture_count, duplicate_file_count, linked_file_count, linked_byte_count, saved_seconds
+
+        bmp_path = get_TXR_export_path(texture_path, output_path)
+
+        if error_message is None and payload_hash_list is not None:
+            # Sub-textures handed out to a file that failed to export are decoded here instead
+            exported_id_set = {output_file[0] for output_file in output_file_list}
+            missing_id_list = [subtexture_id for subtexture_id, payload_hash in enumerate(payload_hash_list)
+                               if subtexture_id not in exported_id_set and payload_hash not in written_payload_dict
+                               and payload_hash_list.index(payload_hash) == subtexture_id]
+            if missing_id_list:
+                missing_output_file_list, error_message, _, _ = exportTXRfileToBuffers(
+                    texture_path, bmp_path, png_export, png_save_options, missing_id_list, rtxr_yakuza_decoding)
+                output_file_list = sorted(output_file_list + missing_output_file_list)
+
+        if error_message is not None:
+            print(error_message + ": " + texture_path)
+            output_file_list = []
+        else:
+            output_file_dict = {output_file[0]: output_file[1:] for output_file in output_file_list}
+            subtexture_id_list = sorted(output_file_dict)
+            if payload_hash_list is not None:
+                subtexture_id_list = range(len(payload_hash_list))
+
+            for subtexture_id in subtexture_id_list:
+                if subtexture_id in output_file_dict:
+                    output_file_path, output_file_bytes, output_seconds = output_file_dict[subtexture_id]
+                    writeExportedFile(output_file_path, output_file_bytes)
+                    if payload_hash_list is not None:
+                        written_payload_dict[payload_hash_list[subtexture_id]] = (output_file_path,
+                                                                                  len(output_file_bytes),
+                                                                                  output_seconds)
+                    continue
+
+                # Repeat of a sub-texture written before, by an earlier file or earlier in this one
+                written_file_path, written_byte_count, written_seconds = \
+                    written_payload_dict[payload_hash_list[subtexture_id]]
+                output_file_path = get_subtexture_export_path(bmp_path, subtexture_id, png_export)
+                if linkExportedFile(written_file_path, output_file_path):
+                    linked_file_count += 1
+                    linked_byte_count += written_byte_count
+                saved_seconds += written_seconds
+                output_file_dict[subtexture_id] = (output_file_path, None, 0.0)
+
+            output_file_list = [output_file_dict[subtexture_id][0] for subtexture_id in subtexture_id_list]
+            subtexture_count += len(output_file_list)
+            print("Exported {} sub-textures from {}".format(len(output_file_list), texture_path))
+
+            if deduplicate:
+                if texture_file_hash in exported_file_hash_set:
+                    duplicate_file_count += 1
+                exported_file_hash_set.add(texture_file_hash)
+
+        # Files that couldn't be read aren't recorded, they're tried again next time
+        if rebuild_manifest is not None and texture_file_hash is not None:
+            # Files that aren't textures are recorded too, so they aren't read again next time
+            rebuild_manifest.record(texture_path, [texture_path], output_file_list, export_settings,
+                                    [texture_file_hash])
+
+    start_time = time.perf_counter()
+
+    if output_queue_size is None:
+        output_queue_size = (worker_count or os.cpu_count() or 1) * 2
+
+    # No pool for 1 worker, tasks run right away then
+    with (contextlib.nullcontext() if worker_count == 1 else multiprocessing.Pool(worker_count)) as export_pool:
+
+        def run_task(task_function, task_arguments):
+            # Function that waits for the result
+            if export_pool is None:
+                task_result = task_function(*task_arguments)
+                return lambda: task_result
+            return export_pool.apply_async(task_function, task_arguments).get
+
+        # Hashing doesn't decode anything, so it's done for all files before the exports are handed out
+        if deduplicate:
+            hash_result_list = [run_task(hashTXRfileSubtextures, (texture_path, rtxr_yakuza_decoding))
+                                for texture_path in export_texture_list]
+
+        pending_export_queue = collections.deque()
+
+        for texture_index, texture_path in enumerate(export_texture_list):
+            # Wait for the oldest file before queueing more, keeps finished outputs from piling up
+            if len(pending_export_queue) >= output_queue_size:
+                pending_texture_path, payload_hash_list, get_export_result = pending_export_queue.popleft()
+                write_export(pending_texture_path, payload_hash_list, *get_export_result())
+
+            bmp_path = get_TXR_export_path(texture_path, output_path)
+            payload_hash_list = None
+            subtexture_id_list = None
+
+            if deduplicate:
+                payload_hash_list, error_message, texture_file_hash = hash_result_list[texture_index]()
+                if error_message is not None:
+                    hash_error_result = ([], error_message, 0.0, texture_file_hash)
+                    pending_export_queue.append((texture_path, None,
+                                                 lambda export_result=hash_error_result: export_result))
+                    continue
+
+                # Files another source overwrites later can't be link targets, and these don't link to anything either
+                if export_path_count[bmp_path] > 1:
+                    payload_hash_list = None
+                else:
+                    # Outputs are written in task order, so the first file with a payload writes it before the repeats
+                    subtexture_id_list = []
+                    for subtexture_id, payload_hash in enumerate(payload_hash_list):
+                        if payload_hash not in claimed_payload_dict:
+                            claimed_payload_dict[payload_hash] = texture_path
+                            subtexture_id_list.append(subtexture_id)
+
+                    # Nothing new in it, the file isn't read again
+                    if not subtexture_id_list:
+                        repeat_result = ([], None, 0.0, texture_file_hash)
+                        pending_export_queue.append((texture_path, payload_hash_list,
+                                                     lambda export_result=repeat_result: export_result))
+                        continue
+
+            pending_export_queue.append((texture_path, payload_hash_list,
+                                         run_task(exportTXRfileToBuffers,
+                                                  (texture_path, bmp_path, png_export, png_save_options,
+                                                   subtexture_id_list, rtxr_yakuza_decoding))))
+
+        while pending_export_queue:
+            pending_texture_path, payload_hash_list, get_export_result = pending_export_queue.popleft()
+            write_export(pending_texture_path, payload_hash_list, *get_export_result())
+
+    print("Exported {} sub-textures from {} files in {:.2f} s".format(subtexture_count, len(export_texture_list),
+                                                                      time.perf_counter() - start_time))
+    if skipped_file_count:
+        print("Skipped {} unchanged files".format(skipped_file_count))
+    if deduplicate:
+        print("Dedup: {} duplicate files, {} files hardlinked instead of written ({:.2f} MB), "
+              "{:.2f} s of decoding/encoding saved".format(duplicate_file_count, linked_file_count,
+                                                            linked_byte_count / 1000000, saved_seconds))
+
+
 def scanDirectoryForFilesByExtension(directory_path, file_extension):
     file_list = []
 
@@ -147,8 +492,11 @@ def groupImagesByFileName(input_image_list):
     return group_dictionary
 
 
-def convertBMPtoTXR(input_path, output_path, png_input=False):
-
+def collectTextureGroups(input_path, output_path, png_input=False) -> list:
+    """
+    Finds input images and groups them by the texture they go into
+    Returns [(texture group, image path list, output texture path)], sub-textures in order
+    """
     if png_input:
         input_image_extension = ".png"
     else:
@@ -156,77 +504,153 @@ def convertBMPtoTXR(input_path, output_path, png_input=False):
 
     # Find all input images
     input_image_list = scanDirectoryForFilesByExtension(input_path, input_image_extension)
-    input_image_list = sorted(input_image_list, key=len)
+    # ".10.bmp" goes after ".9.bmp", same length names go in name order
+    input_image_list = sorted(input_image_list, key=lambda image_path: (len(image_path), image_path))
 
     grouped_bmp_dict = groupImagesByFileName(input_image_list)
 
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    texture_group_list = []
+
     for bmp_group in grouped_bmp_dict:
 
         # Avoid unpacking B_CARTEX.BIN, because of course there is a single file that ruins everything
         if bmp_group[-4:] == ".bin" or bmp_group[-4:] == ".BIN":
             continue
 
-        output_format = b'RTEX'
-        txr_output = RTEX()
+        if os.path.isdir(output_path):
+            output_texture_path = bmp_group.replace(input_path, output_path)
+        elif output_path == "":
+            output_texture_path = bmp_group
+        else:
+            output_texture_path = output_path
 
-        if ((bmp_group[-3:] == ".bg" or bmp_group[-3:] == ".BG")
-                or (output_path.find(".bg") or output_path.find(".BG"))):
-            output_format = b'RHBG'
-            txr_output = RHBG()
+        texture_group_list.append((bmp_group, grouped_bmp_dict[bmp_group], output_texture_path))
 
-        for image_path in grouped_bmp_dict[bmp_group]:
+    return texture_group_list
 
-            if png_input:
-                probably_correct_texture_format = guessColorFormatfromPNG(image_path)
-                png_input = Image.open(image_path)
-                bmp_input = bmp_png_conversion.PNGtoBMP(png_input, probably_correct_texture_format)
-            else:
-                bmp_input = BMPv5()
-                bmp_input.unpack_from_file(image_path)
 
-            if output_format == b'RHBG':
-                txr_output.convert_bmp_headers_to_texture_header(bmp_input)
+def get_pack_texture_format(bmp_group, output_texture_path) -> str:
+    """
+    Texture type a group gets packed into when it isn't given: RHBG for .bg files,
+    MTEX when the texture being replaced is an MTEX, RTEX otherwise
+    """
+    if ((bmp_group[-3:] == ".bg" or bmp_group[-3:] == ".BG")
+            or (output_texture_path[-3:] == ".bg" or output_texture_path[-3:] == ".BG")):
+        return "RHBG"
 
-                if bmp_input.image_header["Image Height"] > 0:
-                    bmp_input.pixel_bytes = flip_pixel_bytes_vertically(bmp_input.pixel_bytes,
-                                                                        bmp_input.image_header["Image Width"],
-                                                                        abs(bmp_input.image_header["Image Height"]),
-                                                                        bmp_input.image_header["BPP"])
+    if os.path.isfile(output_texture_path) and get_file_type(output_texture_path) == "MTEX":
+        return "MTEX"
 
-                txr_output.pixel_bytes_list.append(bmp_input.pixel_bytes)
-                break
+    return "RTEX"
 
-            bmp_color_format = bmp_input.check_color_format()
 
-            # Color Format
-            if bmp_input.image_header["BPP"] > 16 or bmp_input.image_header["BPP"] < 8:
-                print(image_path)
-                raise TypeError("Only 16 bit textures are supported (RGB565, ARGB1555 or ARGB4444) or paletted 8bit")
+def packTextureGroup(bmp_group, image_path_list, output_texture_path, png_input=False, texture_format=None,
+                     source_texture_path=None) -> tuple:
+    """
+    Converts one group of images into a texture and saves it
+    texture_format: "RTEX", "RHBG" or "MTEX", get_pack_texture_format picks one if None
+    source_texture_path: MTEX the images were unpacked from (the output texture itself if None and it's an MTEX),
+    its sub-textures keep their color format, twiddling, compression and tile layout
+    Returns (output texture path, sub-texture count, seconds), module level so pools can run it
+    """
+    start_time = time.perf_counter()
 
-            subtexture_texture_header = dict.copy(txr_output.texture_header)
+    if texture_format is None:
+        texture_format = get_pack_texture_format(bmp_group, output_texture_path)
 
-            if bmp_input.image_header["Compression"] == 0:
-                subtexture_texture_header["Color Format"] = 2
-            elif bmp_input.image_header["Compression"] == 3:
-                if bmp_color_format == "RGB565":
-                    subtexture_texture_header["Color Format"] = 0
-                elif bmp_color_format == "ARGB1555":
-                    subtexture_texture_header["Color Format"] = 2
-                elif bmp_color_format == "ARGB4444":
-                    subtexture_texture_header["Color Format"] = 8
-                else:
-                    raise TypeError("Incorrect color format, save BMP as RGB565, ARGB1555 or ARGB4444")
-            else:
-                raise TypeError("Incorrect compression")
+    match texture_format:
+        case "RTEX":
+            output_format = b'RTEX'
+            txr_output = RTEX()
+        case "RHBG":
+            output_format = b'RHBG'
+            txr_output = RHBG()
+        case "MTEX":
+            output_format = b'MTEX'
+            txr_output = MTEX()
+        case _:
+            raise ValueError("Textures can only be packed as RTEX, RHBG or MTEX")
+
+    source_texture_header_list = []
+    source_tile_codebook_list = []
+    if output_format == b'MTEX':
+        if (source_texture_path is None and os.path.isfile(output_texture_path)
+                and get_file_type(output_texture_path) == "MTEX"):
+            source_texture_path = output_texture_path
+
+        if source_texture_path is not None:
+            # Only the headers and sizes are needed, nothing gets decoded
+            source_texture = MTEX()
+            source_texture.lazy_unpacking = True
+            try:
+                source_texture.unpack_from_file(source_texture_path)
+                source_texture_header_list = source_texture.texture_header_list
+                source_tile_codebook_list = source_texture.tile_codebook_list
+            except (ValueError, struct.error, OSError) as error:
+                print("{}: {}, packing {} with new MTEX settings".format(error, source_texture_path, bmp_group))
+
+    # Images that replace a 16 bit MTEX sub-texture are converted to its color format
+    source_color_format_list = [None] * len(image_path_list)
+    for image_index, source_texture_header in enumerate(source_texture_header_list[:len(image_path_list)]):
+        if source_texture_header["Color Format"] <= 1024:
+            source_color_format_list[image_index] = get_MTEX_color_format_name(source_texture_header["Color Format"])
 
-            # If palette is present in BMP
-            if len(bmp_input.color_table_bytes) > 0:
-                subtexture_texture_header["Palette Usage"] = 4  # 4 means palette is used
-                txr_output.add_palette(bmp_input.color_table_bytes)
-                subtexture_texture_header["Palette Used"] = txr_output.palette_list.index(bmp_input.color_table_bytes) + 1
+    if png_input:
+        # Decoded once, both for the color format guess and the conversion
+        # PNGs that get the same color format are then converted in one call
+        png_numpy_array_list = [numpy.asarray(Image.open(image_path), dtype=numpy.uint8)
+                                for image_path in image_path_list]
+        bmp_input_list = bmp_png_conversion.RGBA8888ArrayListToBMPlist(
+            png_numpy_array_list, [source_color_format or guessColorFormatfromPNGarray(png_numpy_array)
+                                   for png_numpy_array, source_color_format in zip(png_numpy_array_list,
+                                                                                   source_color_format_list)])
+
+    for image_index, image_path in enumerate(image_path_list):
+
+        if png_input:
+            bmp_input = bmp_input_list[image_index]
+        else:
+            bmp_input = BMPv5()
+            bmp_input.unpack_from_file(image_path)
+
+            # Externally authored 24/32-bit BMPs go through the same path as PNGs
+            if bmp_input.image_header["BPP"] == 24 or bmp_input.image_header["BPP"] == 32:
+                png_numpy_array = bmp_png_conversion.convertTrueColorBMPtoRGBA8888(bmp_input)
+                probably_correct_texture_format = (source_color_format_list[image_index]
+                                                   or guessColorFormatfromPNGarray(png_numpy_array))
+                bmp_input = bmp_png_conversion.RGBA8888ArrayToBMP(png_numpy_array, probably_correct_texture_format)
+            elif (source_color_format_list[image_index] is not None and len(bmp_input.color_table_bytes) == 0
+                  and bmp_input.check_color_format() != source_color_format_list[image_index]):
+                png_numpy_array = numpy.asarray(bmp_png_conversion.BMPtoPNG(bmp_input), dtype=numpy.uint8)
+                bmp_input = bmp_png_conversion.RGBA8888ArrayToBMP(png_numpy_array, source_color_format_list[image_index])
+
+        if output_format == b'RHBG':
+            txr_output.convert_bmp_headers_to_texture_header(bmp_input)
+
+            if bmp_input.image_header["Image Height"] > 0:
+                bmp_input.pixel_bytes = flip_pixel_bytes_vertically(bmp_input.pixel_bytes,
+                                                                    bmp_input.image_header["Image Width"],
+                                                                    abs(bmp_input.image_header["Image Height"]),
+                                                                    bmp_input.image_header["BPP"])
 
-            subtexture_texture_header["Image Width"] = bmp_input.image_header["Image Width"]
-            subtexture_texture_header["Image Size (in bytes)"] = len(bmp_input.pixel_bytes)
+            txr_output.pixel_bytes_list.append(bmp_input.pixel_bytes)
+            break
+
+        if output_format == b'MTEX':
+            # Twiddled and compressed when saved, pixels only have to be top-down here
+            source_texture_header = None
+            tile_codebook = None
+            if image_index < len(source_texture_header_list):
+                source_texture_header = source_texture_header_list[image_index]
+            subtexture_texture_header = txr_output.convert_bmp_headers_to_texture_header(bmp_input,
+                                                                                         source_texture_header)
+            # Same tile layout as before, unless the sub-texture got a new color format
+            if (source_texture_header is not None
+                    and subtexture_texture_header["Color Format"] == source_texture_header["Color Format"]):
+                tile_codebook = source_tile_codebook_list[image_index]
 
             if bmp_input.image_header["Image Height"] > 0:
                 bmp_input.pixel_bytes = flip_pixel_bytes_vertically(bmp_input.pixel_bytes,
@@ -234,19 +658,126 @@ def convertBMPtoTXR(input_path, output_path, png_input=False):
                                                                     abs(bmp_input.image_header["Image Height"]),
                                                                     bmp_input.image_header["BPP"])
 
-            txr_output.add_texture(subtexture_texture_header, bmp_input.pixel_bytes)
+            txr_output.add_texture(subtexture_texture_header, bmp_input.pixel_bytes, tile_codebook)
+            continue
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        bmp_color_format = bmp_input.check_color_format()
 
-        if os.path.isdir(output_path):
-            output_texture_path = bmp_group.replace(input_path, output_path)
-        elif output_path == "":
-            output_texture_path = bmp_group
+        # Color Format
+        if bmp_input.image_header["BPP"] > 16 or bmp_input.image_header["BPP"] < 8:
+            print(image_path)
+            raise TypeError("Only 16 bit textures are supported (RGB565, ARGB1555 or ARGB4444) or paletted 8bit")
+
+        subtexture_texture_header = dict.copy(txr_output.texture_header)
+
+        if bmp_input.image_header["Compression"] == 0:
+            subtexture_texture_header["Color Format"] = 2
+        elif bmp_input.image_header["Compression"] == 3:
+            if bmp_color_format == "RGB565":
+                subtexture_texture_header["Color Format"] = 0
+            elif bmp_color_format == "ARGB1555":
+                subtexture_texture_header["Color Format"] = 2
+            elif bmp_color_format == "ARGB4444":
+                subtexture_texture_header["Color Format"] = 8
+            else:
+                raise TypeError("Incorrect color format, save BMP as RGB565, ARGB1555 or ARGB4444")
         else:
-            output_texture_path = output_path
+            raise TypeError("Incorrect compression")
+
+        # If palette is present in BMP
+        if len(bmp_input.color_table_bytes) > 0:
+            subtexture_texture_header["Palette Usage"] = 4  # 4 means palette is used
+            txr_output.add_palette(bmp_input.color_table_bytes)
+            subtexture_texture_header["Palette Used"] = txr_output.palette_list.index(bmp_input.color_table_bytes) + 1
+
+        subtexture_texture_header["Image Width"] = bmp_input.image_header["Image Width"]
+        subtexture_texture_header["Image Size (in bytes)"] = len(bmp_input.pixel_bytes)
+
+        if bmp_input.image_header["Image Height"] > 0:
+            bmp_input.pixel_bytes = flip_pixel_bytes_vertically(bmp_input.pixel_bytes,
+                                                                bmp_input.image_header["Image Width"],
+                                                                abs(bmp_input.image_header["Image Height"]),
+                                                                bmp_input.image_header["BPP"])
+
+        txr_output.add_texture(subtexture_texture_header, bmp_input.pixel_bytes)
+
+    txr_output.save(output_texture_path)
+
+    return output_texture_path, len(txr_output.pixel_bytes_list), time.perf_counter() - start_time
+
+
+def packTextureGroups(texture_group_list, png_input=False, worker_count=1, rebuild_manifest=None,
+                      texture_format_dict=None, source_texture_dict=None) -> dict:
+    """
+    Packs groups from collectTextureGroups, returns {output texture path: seconds}
+    worker_count other than 1 packs whole groups in that many processes (all cores if None),
+    largest groups go first so they don't end up last on a single core
+    rebuild_manifest (rebuild_cache.RebuildManifest) skips textures whose images didn't change since the last pack
+    texture_format_dict: {texture group: "RTEX"/"RHBG"/"MTEX"}, groups that aren't in it use get_pack_texture_format
+    source_texture_dict: {texture group: texture it was unpacked from}, see packTextureGroup
+    """
+    group_time_dict = {}
+    start_time = time.perf_counter()
+
+    if texture_format_dict is None:
+        texture_format_dict = {}
+    if source_texture_dict is None:
+        source_texture_dict = {}
+
+    pack_task_list = []
+    pack_settings_dict = {}
+    image_path_list_dict = {}
+    for bmp_group, image_path_list, output_texture_path in texture_group_list:
+        texture_format = texture_format_dict.get(bmp_group)
+        if texture_format is None:
+            texture_format = get_pack_texture_format(bmp_group, output_texture_path)
+
+        pack_settings = {"PNG Input": png_input, "Texture Format": texture_format}
+        if rebuild_manifest is not None and rebuild_manifest.is_up_to_date(output_texture_path, image_path_list,
+                                                                           pack_settings):
+            continue
+        pack_task_list.append((bmp_group, image_path_list, output_texture_path, png_input, texture_format,
+                               source_texture_dict.get(bmp_group)))
+        pack_settings_dict[output_texture_path] = pack_settings
+        image_path_list_dict[output_texture_path] = image_path_list
+
+    if worker_count == 1:
+        pack_result_iterator = (packTextureGroup(*pack_task) for pack_task in pack_task_list)
+        pack_pool = None
+    else:
+        pack_task_list.sort(key=lambda pack_task: sum(os.path.getsize(image_path) for image_path in pack_task[1]),
+                            reverse=True)
+        pack_pool = multiprocessing.Pool(worker_count)
+        pack_result_iterator = pack_pool.imap_unordered(packTextureGroupTask, pack_task_list)
+
+    try:
+        for output_texture_path, subtexture_count, group_time in pack_result_iterator:
+            group_time_dict[output_texture_path] = group_time
+            print("Saved {} ({} sub-textures, {:.2f} s)".format(output_texture_path, subtexture_count, group_time))
+            if rebuild_manifest is not None:
+                rebuild_manifest.record(output_texture_path, image_path_list_dict[output_texture_path],
+                                        [output_texture_path], pack_settings_dict[output_texture_path])
+    finally:
+        if pack_pool is not None:
+            pack_pool.close()
+            pack_pool.join()
+
+    print("Packed {} textures in {:.2f} s".format(len(group_time_dict), time.perf_counter() - start_time))
+    if len(texture_group_list) > len(pack_task_list):
+        print("Skipped {} unchanged textures".format(len(texture_group_list) - len(pack_task_list)))
 
-        txr_output.save(output_texture_path)
-        print("Saved " + output_texture_path)
+    return group_time_dict
+
+
+def packTextureGroupTask(pack_task) -> tuple:
+    # imap_unordered passes a single argument
+    return packTextureGroup(*pack_task)
+
+
+def convertBMPtoTXR(input_path, output_path, png_input=False, worker_count=1) -> dict:
+    # Returns {output texture path: seconds it took}
+    # Textures that replace an MTEX stay MTEX, see get_pack_texture_format
+    return packTextureGroups(collectTextureGroups(input_path, output_path, png_input), png_input, worker_count)
 
 
 # SR2Tools-converted BMP have correct color formats, so you can just use check_color_format with them
@@ -256,36 +787,225 @@ def convertBMPtoTXR(input_path, output_path, png_input=False):
 # ARGB4444 - else
 def guessColorFormatfromPNG(png_path):
     unpacked_png = Image.open(png_path)
-    png_array = numpy.asarray(unpacked_png)
-    channel_count = png_array.shape[2]
+    return guessColorFormatfromPNGarray(numpy.asarray(unpacked_png))
+
 
-    if channel_count == 3:
+def guessColorFormatfromPNGarray(png_array, chunk_pixel_count=0x10000):
+    """
+    Alpha values are counted chunk by chunk with bincount,
+    the first value between 0 and 255 means ARGB4444 and stops the scan
+    """
+    if png_array.ndim < 3 or png_array.shape[2] < 4:
         return "RGB565"
 
-    alpha_array = png_array[:, :, 3]
+    alpha_array = png_array[:, :, 3].ravel()
 
-    min_alpha_value = numpy.min(alpha_array)
+    transparent_pixels_found = False
+    opaque_pixels_found = False
 
-    if min_alpha_value == 255:
-        return "RGB565"
+    for chunk_start in range(0, len(alpha_array), chunk_pixel_count):
+        alpha_counts = numpy.bincount(alpha_array[chunk_start:chunk_start + chunk_pixel_count], minlength=256)
 
-    max_alpha_value = numpy.max(alpha_array)
+        if alpha_counts[1:255].any():
+            return "ARGB4444"
 
-    if min_alpha_value != 0 or max_alpha_value != 255:
-        return "ARGB4444"
+        transparent_pixels_found = transparent_pixels_found or alpha_counts[0] > 0
+        opaque_pixels_found = opaque_pixels_found or alpha_counts[255] > 0
 
-    if True in ((alpha_array > 0) & (alpha_array < 255)):
+    if not transparent_pixels_found:
+        return "RGB565"
+
+    # Fully transparent images were always guessed as ARGB4444
+    if not opaque_pixels_found:
         return "ARGB4444"
-    else:
-        return "ARGB1555"
+
+    return "ARGB1555"
 
 
 def flip_pixel_bytes_vertically(pixel_bytes, image_width, image_height, bpp):
+    # Reversed row view, copied once by tobytes
     image_line_byte_size = (image_width * bpp) // 8
-    flipped_pixel_bytes = b''.join(reversed([pixel_bytes[i:i + image_line_byte_size] for i in range(0, (image_width*image_height*bpp)//8, image_line_byte_size)]))
-    return flipped_pixel_bytes
+    numpy_pixel_byte_array = numpy.frombuffer(pixel_bytes, dtype=numpy.uint8, count=image_line_byte_size * image_height)
+    return numpy_pixel_byte_array.reshape(image_height, image_line_byte_size)[::-1].tobytes()
 
 
 def flip_pixel_bytes_horizontally(pixel_bytes, image_width, image_height, bpp):
     flipped_pixel_bytes = b''.join(reversed([pixel_bytes[i:i + 2] for i in range(0, len(pixel_bytes), 2)]))
     return flipped_pixel_bytes
+
+
+def check_batch_export_with_corrupt_file(worker_count=1):
+    # A good texture and an MTEX with a broken compression mini header in one batch,
+    # the good one has to be exported and the broken one reported without stopping the batch
+    import tempfile
+
+    good_texture = RTEX()
+    good_texture_header = dict.copy(good_texture.texture_header)
+    good_texture_header["Image Width"] = 16
+    good_texture_header["Image Size (in bytes)"] = 16 * 16 * 2
+    good_texture.add_texture(good_texture_header, bytes(16 * 16 * 2))
+
+    corrupt_texture = MTEX()
+    corrupt_texture_header = dict.copy(corrupt_texture.texture_header)
+    corrupt_texture_header["Color Format"] = MTEX_TWIDDLED
+    corrupt_texture_header["Compressed"] = 1
+    corrupt_texture_header["Image Width"] = 64
+    corrupt_texture.add_texture(corrupt_texture_header, bytes(64 * 64 * 2))
+    corrupt_texture_bytes = bytearray(corrupt_texture.pack_and_return())
+    # Uncompressed size in the mini header of the first sub-texture, the data runs out long before that
+    struct.pack_into("<I", corrupt_texture_bytes, 0x1004, struct.unpack_from("<I", corrupt_texture_bytes, 0x1004)[0] * 4)
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        good_texture_path = os.path.join(temporary_folder, "good.txr")
+        corrupt_texture_path = os.path.join(temporary_folder, "corrupt.txr")
+        good_texture.save(good_texture_path)
+        with open(corrupt_texture_path, "wb") as corrupt_texture_file:
+            corrupt_texture_file.write(corrupt_texture_bytes)
+
+        output_folder = os.path.join(temporary_folder, "out", "")
+        batchConvertTXRtoBMP([corrupt_texture_path, os.path.join(temporary_folder, "missing.txr"), good_texture_path],
+                             output_folder, png_export=True, worker_count=worker_count)
+
+        if sorted(os.listdir(output_folder)) != ["good.txr.0.png"]:
+            raise ValueError("Corrupt file stopped the batch or left outputs behind")
+
+
+def check_RTXR_yakuza_export(worker_count=1):
+    # RTXR sub-textures stored as is, as a bare Yakuza LZ stream and with the MTEX mini header
+    # Refused by default. With rtxr_yakuza_decoding they have to decode to the same bytes as the reference unyakuza,
+    # pack back unchanged and export to the original pixels
+    import tempfile
+    from unyakuza import unyakuza
+    from yakuza import yakuza
+
+    image_width, image_height = 32, 16
+    pixel_bytes_list = [bytes((i // row_length) % 256 for i in range(image_width * image_height * 2))
+                        for row_length in (7, 64, 200)]
+
+    rtxr_texture = RTXR()
+    for subtexture_id, pixel_bytes in enumerate(pixel_bytes_list):
+        compressed_bytes = pixel_bytes
+        if subtexture_id == 1:
+            compressed_bytes = yakuza(pixel_bytes)
+        elif subtexture_id == 2:
+            compressed_bytes = yakuza_subtexture(pixel_bytes)
+
+        texture_header = dict.copy(rtxr_texture.texture_header)
+        texture_header["Color Format"] = 2
+        texture_header["Image Width"] = image_width
+        texture_header["Image Height"] = image_height
+        texture_header["Image Size (in bytes)"] = len(compressed_bytes)
+        rtxr_texture.texture_header_list.append(texture_header)
+        rtxr_texture.compressed_pixel_bytes_list.append(compressed_bytes)
+    rtxr_texture.file_header["Texture Count"] = len(pixel_bytes_list)
+    rtxr_texture_bytes = rtxr_texture.pack_and_return()
+
+    try:
+        RTXR().unpack_from_bytes(rtxr_texture_bytes)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("RTXR was decoded without rtxr_yakuza_decoding")
+
+    decoded_texture = create_texture_by_signature(rtxr_texture_bytes[:4], rtxr_yakuza_decoding=True)
+    decoded_texture.unpack_from_bytes(rtxr_texture_bytes)
+
+    reference_pixel_bytes_list = [pixel_bytes_list[0],
+                                  bytes(unyakuza(rtxr_texture.compressed_pixel_bytes_list[1],
+                                                 len(rtxr_texture.compressed_pixel_bytes_list[1]),
+                                                 len(pixel_bytes_list[1]))),
+                                  unyakuza_subtexture(rtxr_texture.compressed_pixel_bytes_list[2], fast_unyakuza=False)]
+    if list(decoded_texture.pixel_bytes_list) != reference_pixel_bytes_list:
+        raise ValueError("RTXR decoding doesn't match the reference unyakuza")
+    if reference_pixel_bytes_list != pixel_bytes_list:
+        raise ValueError("RTXR decoding doesn't give back the original pixels")
+    if decoded_texture.pack_and_return() != rtxr_texture_bytes:
+        raise ValueError("Decoded RTXR doesn't pack back to the same file")
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        rtxr_texture_path = os.path.join(temporary_folder, "rtxr.txr")
+        with open(rtxr_texture_path, "wb") as rtxr_texture_file:
+            rtxr_texture_file.write(rtxr_texture_bytes)
+
+        for rtxr_yakuza_decoding in (False, True):
+            output_folder = os.path.join(temporary_folder, str(rtxr_yakuza_decoding), "")
+            os.makedirs(output_folder)
+            batchConvertTXRtoBMP([rtxr_texture_path], output_folder, worker_count=worker_count,
+                                 rtxr_yakuza_decoding=rtxr_yakuza_decoding)
+
+            output_file_list = sorted(os.listdir(output_folder))
+            if not rtxr_yakuza_decoding:
+                if output_file_list:
+                    raise ValueError("RTXR was exported without rtxr_yakuza_decoding")
+                continue
+
+            if output_file_list != ["rtxr.txr.{}.bmp".format(i) for i in range(len(pixel_bytes_list))]:
+                raise ValueError("RTXR wasn't exported with rtxr_yakuza_decoding")
+            for output_file_name, pixel_bytes in zip(output_file_list, pixel_bytes_list):
+                output_bmp = BMPv5()
+                output_bmp.unpack_from_file(os.path.join(output_folder, output_file_name))
+                if bytes(output_bmp.pixel_bytes) != pixel_bytes:
+                    raise ValueError("Exported RTXR pixels don't match " + output_file_name)
+
+
+def check_batch_export_deduplication(worker_count=1):
+    # A file and its copy, and a broken file sharing a sub-texture with a good one that comes after it
+    # Outputs have to match an export without deduplicate, repeats have to be hardlinked
+    # and the good file still has to get the sub-texture its broken owner couldn't export
+    import tempfile
+
+    def make_mtex(pixel_bytes_list):
+        mtex_texture = MTEX()
+        for pixel_bytes in pixel_bytes_list:
+            texture_header = dict.copy(mtex_texture.texture_header)
+            texture_header["Color Format"] = MTEX_TWIDDLED
+            texture_header["Compressed"] = 1
+            texture_header["Image Width"] = 16
+            mtex_texture.add_texture(texture_header, pixel_bytes)
+        return bytearray(mtex_texture.pack_and_return())
+
+    pixel_bytes_list = [bytes((i // row_length) % 256 for i in range(16 * 16 * 2)) for row_length in (3, 5, 9)]
+
+    texture_bytes_dict = {"shared.txr": make_mtex(pixel_bytes_list[:2]),
+                          "copy.txr": make_mtex(pixel_bytes_list[:2]),
+                          "broken.txr": make_mtex([bytes(16 * 16 * 2), pixel_bytes_list[2]]),
+                          "good.txr": make_mtex(pixel_bytes_list[2:])}
+    # Uncompressed size in the mini header of the first sub-texture, the data runs out long before that
+    broken_texture_bytes = texture_bytes_dict["broken.txr"]
+    struct.pack_into("<I", broken_texture_bytes, 0x1004, struct.unpack_from("<I", broken_texture_bytes, 0x1004)[0] * 4)
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        texture_path_list = []
+        for texture_name, texture_bytes in texture_bytes_dict.items():
+            texture_path_list.append(os.path.join(temporary_folder, texture_name))
+            with open(texture_path_list[-1], "wb") as texture_file:
+                texture_file.write(texture_bytes)
+
+        output_file_dict = {}
+        for deduplicate in (False, True):
+            output_folder = os.path.join(temporary_folder, str(deduplicate), "")
+            os.makedirs(output_folder)
+            batchConvertTXRtoBMP(texture_path_list, output_folder, png_export=True, worker_count=worker_count,
+                                 deduplicate=deduplicate)
+
+            output_file_dict[deduplicate] = {}
+            for output_file_name in os.listdir(output_folder):
+                with open(os.path.join(output_folder, output_file_name), "rb") as output_file:
+                    output_file_dict[deduplicate][output_file_name] = output_file.read()
+
+        if sorted(output_file_dict[False]) != ["copy.txr.0.png", "copy.txr.1.png", "good.txr.0.png",
+                                               "shared.txr.0.png", "shared.txr.1.png"]:
+            raise ValueError("Unexpected outputs: " + ", ".join(sorted(output_file_dict[False])))
+        if output_file_dict[True] != output_file_dict[False]:
+            raise ValueError("Deduplicated export doesn't match the regular one")
+
+        for output_file_name in ("copy.txr.0.png", "copy.txr.1.png"):
+            if os.stat(os.path.join(temporary_folder, "True", output_file_name)).st_nlink < 2:
+                raise ValueError(output_file_name + " wasn't hardlinked")
+
+
+if __name__ == "__main__":
+    for check_worker_count in (1, 2):
+        check_batch_export_with_corrupt_file(check_worker_count)
+        check_RTXR_yakuza_export(check_worker_count)
+        check_batch_export_deduplication(check_worker_count)
@@ -0,0 +1,64 @@
+"""
+Dreamcast twiddling (Morton/Z-order) for square power of 2 textures
+Twiddled data goes in quadrant order, recursively:
+ 1 3
+ 2 4
+"""
+import numpy
+
+twiddle_table_cache = {}
+
+
+def spread_bits(numpy_array) -> numpy.array:
+    # 0b1111 -> 0b01010101
+    numpy_array = numpy_array.astype(numpy.int64)
+    numpy_array = (numpy_array | (numpy_array << 8)) & 0x00FF00FF
+    numpy_array = (numpy_array | (numpy_array << 4)) & 0x0F0F0F0F
+    numpy_array = (numpy_array | (numpy_array << 2)) & 0x33333333
+    numpy_array = (numpy_array | (numpy_array << 1)) & 0x55555555
+    return numpy_array
+
+
+def get_twiddle_table(size) -> numpy.array:
+    """
+    Returns a (size, size) array with the twiddled position of every row/column
+    Tables are built once per size and shared, don't write into them
+    """
+    if size in twiddle_table_cache:
+        return twiddle_table_cache[size]
+
+    if size < 1 or size & (size - 1) != 0:
+        raise ValueError("Twiddled textures have to be a power of 2 in size")
+
+    rows = spread_bits(numpy.arange(size)).reshape(size, 1)
+    columns = spread_bits(numpy.arange(size)).reshape(1, size)
+
+    # Row goes first, since the bottom left quadrant comes before the top right one
+    twiddle_table = rows | (columns << 1)
+    twiddle_table.setflags(write=False)
+
+    twiddle_table_cache[size] = twiddle_table
+    return twiddle_table
+
+
+def untwiddle(twiddled_array, size) -> numpy.array:
+    """
+    Flat twiddled array -> (size, size) array in row order
+    Any extra dimensions (like tile pixels) are kept: (size * size, ...) -> (size, size, ...)
+    """
+    return numpy.asarray(twiddled_array)[get_twiddle_table(size)]
+
+
+def twiddle(untwiddled_array, size) -> numpy.array:
+    """
+    (size, size) or flat array in row order -> flat twiddled array
+    Any extra dimensions are kept: (size, size, ...) -> (size * size, ...)
+    """
+    untwiddled_array = numpy.asarray(untwiddled_array)
+    if untwiddled_array.shape[:2] == (size, size):
+        untwiddled_array = untwiddled_array.reshape((size * size,) + untwiddled_array.shape[2:])
+
+    twiddled_array = numpy.empty_like(untwiddled_array)
+    twiddled_array[get_twiddle_table(size).ravel()] = untwiddled_array
+
+    return twiddled_array
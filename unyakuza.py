@@ -51,4 +51,330 @@ def unyakuza(input_data: bytes, src_size: int, dest_size: int) -> bytes:
     return bytearray(decomp_buff)
 
 
+def unyakuza_fast(input_data: bytes, src_size: int, dest_size: int) -> bytes:
+    # Same stream as unyakuza, but written straight into a preallocated bytearray
+    # Back-references are copied as slices instead of one byte at a time
+    # Sizes that don't match input_data raise ValueError instead of IndexError
+    decomp_buff = bytearray(dest_size)
 
+    src_idx = 0
+    dest_idx = 0
+
+    flag_bit_idx = 8
+
+    try:
+        flag = input_data[src_idx]
+        src_idx += 1
+
+        while dest_idx < dest_size:
+            if src_idx >= src_size:
+                return input_data
+
+            is_comp = ((flag & 0x80) != 0)
+
+            flag = flag << 1
+            flag_bit_idx -= 1
+            if flag_bit_idx < 1:
+                flag = input_data[src_idx]
+                src_idx += 1
+                flag_bit_idx = 8
+
+            if is_comp:
+                first_byte = input_data[src_idx]
+                ref_offset = ((first_byte >> 4) | (input_data[src_idx+1] << 4)) + 1
+                length = (first_byte & 0x0F) + 3
+                if length > dest_size - dest_idx:
+                    length = dest_size - dest_idx
+
+                ref_idx = dest_idx - ref_offset
+                copy_end = dest_idx + length
+
+                if ref_idx < 0:
+                    # Reference reaches before the start of the buffer, keep the original per-byte behavior
+                    for j in range(length):
+                        decomp_buff[dest_idx + j] = decomp_buff[ref_idx + j]
+                elif ref_offset >= length:
+                    decomp_buff[dest_idx:copy_end] = decomp_buff[ref_idx:ref_idx + length]
+                else:
+                    # Overlapping run, every copied block doubles the repeating span
+                    copy_idx = dest_idx
+                    span = ref_offset
+                    while copy_idx < copy_end:
+                        block_end = copy_idx + span
+                        if block_end > copy_end:
+                            block_end = copy_end
+                        decomp_buff[copy_idx:block_end] = decomp_buff[copy_idx - span:block_end - span]
+                        copy_idx = block_end
+                        span *= 2
+
+                dest_idx = copy_end
+                src_idx += 2
+            else:
+                decomp_buff[dest_idx] = input_data[src_idx]
+                dest_idx += 1
+                src_idx += 1
+    except IndexError:
+        # Compressed size or uncompressed size in the mini header doesn't match the data
+        raise ValueError("Compressed data is truncated or corrupt") from None
+
+    return decomp_buff
+
+
+def unyakuza_checked(input_data: bytes, src_size: int, dest_size: int) -> bytearray:
+    # Same stream as unyakuza_fast, for data that isn't known to be Yakuza LZ at all
+    # Arbitrary bytes usually "decode" to dest_size bytes, so the stream also has to end exactly at src_size
+    # and never reference bytes before the start of the output, otherwise ValueError is raised
+    if len(input_data) < src_size or src_size < 1:
+        raise ValueError("Compressed data is shorter than its size")
+
+    decomp_buff = bytearray(dest_size)
+
+    src_idx = 0
+    dest_idx = 0
+
+    flag_bit_idx = 8
+    flag = input_data[src_idx]
+    src_idx += 1
+
+    while dest_idx < dest_size:
+        is_comp = ((flag & 0x80) != 0)
+
+        flag = flag << 1
+        flag_bit_idx -= 1
+        if flag_bit_idx < 1:
+            if src_idx >= src_size:
+                raise ValueError("Compressed data ended before the output was full")
+            flag = input_data[src_idx]
+            src_idx += 1
+            flag_bit_idx = 8
+
+        if is_comp:
+            if src_idx + 2 > src_size:
+                raise ValueError("Compressed data ended before the output was full")
+            first_byte = input_data[src_idx]
+            ref_offset = ((first_byte >> 4) | (input_data[src_idx+1] << 4)) + 1
+            length = (first_byte & 0x0F) + 3
+            if length > dest_size - dest_idx:
+                length = dest_size - dest_idx
+
+            if ref_offset > dest_idx:
+                raise ValueError("Back-reference reaches before the start of the output")
+
+            # Byte by byte, so overlapping runs repeat
+            for ref_idx in range(dest_idx - ref_offset, dest_idx - ref_offset + length):
+                decomp_buff[dest_idx] = decomp_buff[ref_idx]
+                dest_idx += 1
+            src_idx += 2
+        else:
+            if src_idx >= src_size:
+                raise ValueError("Compressed data ended before the output was full")
+            decomp_buff[dest_idx] = input_data[src_idx]
+            dest_idx += 1
+            src_idx += 1
+
+    if src_idx != src_size:
+        raise ValueError("Output was full before the compressed data ended")
+
+    return decomp_buff
+
+
+WINDOW_SIZE = 0x1000  # 12 bit offset
+
+
+class UnyakuzaDecoder:
+    # Incremental version of unyakuza
+    # Compressed bytes can be fed in chunks of any size, decoded bytes are read as soon as they are ready
+    # Only the last 4 KB of output are kept for back-references
+    #
+    # unyakuza returns the input as is if it runs out of compressed bytes before reaching dest_size.
+    # In that case truncated is set and decoding stops, the caller has to fall back to the raw input.
+    def __init__(self, src_size: int, dest_size: int):
+        self.src_size = src_size
+        self.dest_size = dest_size
+
+        self.src_idx = 0
+        self.dest_idx = 0
+
+        self.flag = None
+        self.flag_bit_idx = 8
+
+        self.input_buffer = bytearray()
+
+        self.window = bytearray()
+        self.window_start = 0  # Absolute position of window[0] in the output
+        self.read_idx = 0  # Absolute position of the next byte given out by read()
+
+        self.truncated = False
+
+    @property
+    def finished(self):
+        return self.truncated or self.dest_idx >= self.dest_size
+
+    def feed(self, chunk):
+        self.input_buffer += chunk
+        self.decode_available()
+
+    def decode_available(self):
+        input_buffer = self.input_buffer
+        window = self.window
+        buffer_idx = 0
+
+        if self.flag is None:
+            if len(input_buffer) == 0:
+                return
+            self.flag = input_buffer[0]
+            self.src_idx += 1
+            buffer_idx += 1
+
+        flag = self.flag
+        flag_bit_idx = self.flag_bit_idx
+        src_idx = self.src_idx
+        dest_idx = self.dest_idx
+        dest_size = self.dest_size
+
+        while dest_idx < dest_size:
+            if src_idx >= self.src_size:
+                self.truncated = True
+                break
+
+            is_comp = ((flag & 0x80) != 0)
+
+            # Wait until the whole item (and the next flag byte, if it comes first) is here
+            bytes_needed = 2 if is_comp else 1
+            if flag_bit_idx - 1 < 1:
+                bytes_needed += 1
+            if len(input_buffer) - buffer_idx < bytes_needed:
+                break
+
+            flag = flag << 1
+            flag_bit_idx -= 1
+            if flag_bit_idx < 1:
+                flag = input_buffer[buffer_idx]
+                buffer_idx += 1
+                src_idx += 1
+                flag_bit_idx = 8
+
+            if is_comp:
+                ref_offset = ((input_buffer[buffer_idx] >> 4) | (input_buffer[buffer_idx + 1] << 4)) + 1
+                length = min((input_buffer[buffer_idx] & 0x0F) + 3, dest_size - dest_idx)
+
+                for j in range(length):
+                    ref_idx = dest_idx - ref_offset
+                    if ref_idx < 0:
+                        # unyakuza wraps around to the end of its zero filled buffer
+                        ref_idx += dest_size
+                        if ref_idx < 0:
+                            raise IndexError("Back-reference reaches past the start of the output")
+                        elif ref_idx >= dest_idx:
+                            window.append(0)
+                        else:
+                            window.append(window[ref_idx - self.window_start])
+                    else:
+                        window.append(window[ref_idx - self.window_start])
+                    dest_idx += 1
+
+                buffer_idx += 2
+                src_idx += 2
+            else:
+                window.append(input_buffer[buffer_idx])
+                dest_idx += 1
+                buffer_idx += 1
+                src_idx += 1
+
+        del input_buffer[:buffer_idx]
+
+        self.flag = flag
+        self.flag_bit_idx = flag_bit_idx
+        self.src_idx = src_idx
+        self.dest_idx = dest_idx
+
+        self.trim_window()
+
+    def trim_window(self):
+        # Keep the back-reference window and everything that hasn't been read yet
+        # Short outputs are kept whole, since wrapped references can reach any of their bytes
+        if self.dest_size <= WINDOW_SIZE:
+            return
+
+        keep_from = min(self.read_idx, self.dest_idx - WINDOW_SIZE)
+        if keep_from > self.window_start:
+            del self.window[:keep_from - self.window_start]
+            self.window_start = keep_from
+
+    def read(self, n=-1) -> bytes:
+        available = self.dest_idx - self.read_idx
+        if n < 0 or n > available:
+            n = available
+
+        start = self.read_idx - self.window_start
+        output_bytes = bytes(self.window[start:start + n])
+        self.read_idx += n
+
+        self.trim_window()
+
+        return output_bytes
+
+
+def unyakuza_stream(input_file, output_file, src_size: int, dest_size: int, chunk_size: int = 0x10000):
+    # Decompress src_size bytes from input_file into output_file without holding either in memory
+    # Both files are expected to be positioned at the start of the data and be seekable
+    input_start = input_file.tell()
+    output_start = output_file.tell()
+
+    decoder = UnyakuzaDecoder(src_size, dest_size)
+
+    src_left = src_size
+    while not decoder.finished:
+        chunk = input_file.read(min(chunk_size, src_left)) if src_left > 0 else b''
+        if len(chunk) == 0:
+            # unyakuza would read past src_size here
+            raise EOFError("Compressed data ended in the middle of an item")
+        src_left -= len(chunk)
+
+        decoder.feed(chunk)
+        output_file.write(decoder.read())
+
+    if decoder.truncated:
+        # Same as unyakuza returning the input as is
+        input_file.seek(input_start)
+        output_file.seek(output_start)
+        output_file.truncate()
+
+        src_left = src_size
+        while src_left > 0:
+            chunk = input_file.read(min(chunk_size, src_left))
+            if len(chunk) == 0:
+                break
+            output_file.write(chunk)
+            src_left -= len(chunk)
+    else:
+        input_file.seek(input_start + decoder.src_idx)
+
+
+def benchmark_unyakuza(data_size=0x40000, repeat_count=3):
+    import random
+    import time
+    from yakuza import yakuza
+
+    # Something texture-like: long runs of repeated tiles with some noise
+    random.seed(0)
+    uncompressed_bytes = bytes((i // 64) % 256 if random.random() < 0.98 else random.getrandbits(8)
+                               for i in range(data_size))
+    compressed_bytes = yakuza(uncompressed_bytes, 1)
+
+    reference_bytes = bytes(unyakuza(compressed_bytes, len(compressed_bytes), data_size))
+
+    for decompressor in (unyakuza, unyakuza_fast):
+        start_time = time.perf_counter()
+        for _ in range(repeat_count):
+            output_bytes = bytes(decompressor(compressed_bytes, len(compressed_bytes), data_size))
+        decompression_time = (time.perf_counter() - start_time) / repeat_count
+
+        if output_bytes != reference_bytes or output_bytes != uncompressed_bytes:
+            raise ValueError(decompressor.__name__ + " output doesn't match the reference")
+
+        print("{}: {:.2f} MB/s".format(decompressor.__name__, data_size / decompression_time / 1000000))
+
+
+if __name__ == "__main__":
+    benchmark_unyakuza()
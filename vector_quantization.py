@@ -0,0 +1,73 @@
+"""
+Vector quantization (k-means) for MTEX 2x2 tile codebooks
+"""
+import time
+import numpy
+
+
+def find_nearest_codebook_entries(vector_array, codebook, batch_size=16384) -> numpy.array:
+    """
+    Index of the closest codebook entry for every vector
+    Distances are calculated batch_size vectors at a time to keep memory use flat on big textures
+    """
+    vector_array = numpy.asarray(vector_array, dtype=numpy.float32)
+    codebook = numpy.asarray(codebook, dtype=numpy.float32)
+
+    # |v - c|^2 = |v|^2 - 2 v.c + |c|^2, |v|^2 doesn't change the closest entry
+    codebook_norm_array = (codebook ** 2).sum(axis=1)
+
+    nearest_index_array = numpy.empty(len(vector_array), dtype=numpy.int64)
+    for batch_start in range(0, len(vector_array), batch_size):
+        batch = vector_array[batch_start:batch_start + batch_size]
+        distance_array = codebook_norm_array - 2 * (batch @ codebook.T)
+        nearest_index_array[batch_start:batch_start + batch_size] = distance_array.argmin(axis=1)
+
+    return nearest_index_array
+
+
+def build_vq_codebook(vector_array, weight_array=None, codebook_size=256,
+                      max_iterations=16, time_budget=None, seed=0) -> numpy.array:
+    """
+    Lloyd's k-means over (N, D) vectors, returns a (codebook_size, D) float32 codebook
+    weight_array lets duplicates be passed once with their count
+    Stops after max_iterations, after time_budget seconds or once no vector changes its entry
+    """
+    vector_array = numpy.asarray(vector_array, dtype=numpy.float32)
+    vector_count, dimension_count = vector_array.shape
+
+    if weight_array is None:
+        weight_array = numpy.ones(vector_count, dtype=numpy.float32)
+    weight_array = numpy.asarray(weight_array, dtype=numpy.float32)
+
+    if vector_count <= codebook_size:
+        codebook = numpy.zeros((codebook_size, dimension_count), dtype=numpy.float32)
+        codebook[:vector_count] = vector_array
+        return codebook
+
+    random_generator = numpy.random.default_rng(seed)
+    codebook = vector_array[random_generator.choice(vector_count, codebook_size, replace=False)].copy()
+
+    start_time = time.perf_counter()
+    assignment_array = None
+
+    for iteration in range(max_iterations):
+        new_assignment_array = find_nearest_codebook_entries(vector_array, codebook)
+        if assignment_array is not None and numpy.array_equal(assignment_array, new_assignment_array):
+            break
+        assignment_array = new_assignment_array
+
+        cluster_weight_array = numpy.bincount(assignment_array, weights=weight_array, minlength=codebook_size)
+        cluster_sum_array = numpy.empty((codebook_size, dimension_count), dtype=numpy.float64)
+        for dimension in range(dimension_count):
+            cluster_sum_array[:, dimension] = numpy.bincount(assignment_array,
+                                                             weights=vector_array[:, dimension] * weight_array,
+                                                             minlength=codebook_size)
+
+        # Empty clusters keep their old entry
+        used_clusters = cluster_weight_array > 0
+        codebook[used_clusters] = cluster_sum_array[used_clusters] / cluster_weight_array[used_clusters, None]
+
+        if time_budget is not None and time.perf_counter() - start_time > time_budget:
+            break
+
+    return codebook
@@ -0,0 +1,162 @@
+# Compressor for the stream that unyakuza.py reads
+# Flag byte (bit 7 first, 1 - back-reference, 0 - literal)
+# Back-reference is 2 bytes: low nibble - length - 3, the other 12 bits - offset - 1
+#
+# unyakuza reads the next flag byte as soon as the last bit of the current one is used,
+# so every 8th item has its data placed after the next flag byte.
+import time
+
+WINDOW_SIZE = 0x1000  # 12 bit offset
+MIN_MATCH = 3
+MAX_MATCH = 18  # 4 bit length + 3
+
+# Level: (max hash chain steps, lazy matching, insert positions inside of matches)
+yakuza_levels = {
+    1: (2, False, False),
+    2: (4, False, False),
+    3: (8, False, True),
+    4: (16, False, True),
+    5: (32, True, True),
+    6: (64, True, True),
+    7: (256, True, True),
+    8: (1024, True, True),
+    9: (WINDOW_SIZE, True, True),
+}
+
+
+def find_longest_match(data, position, head, prev, max_chain_steps):
+    data_size = len(data)
+    max_length = min(MAX_MATCH, data_size - position)
+
+    best_length = 0
+    best_offset = 0
+
+    if max_length < MIN_MATCH:
+        return best_length, best_offset
+
+    key = data[position] | (data[position + 1] << 8) | (data[position + 2] << 16)
+    candidate = head.get(key, -1)
+
+    steps = 0
+    while candidate >= 0 and position - candidate <= WINDOW_SIZE and steps < max_chain_steps:
+        # Candidates are already known to share the first 3 bytes
+        length = MIN_MATCH
+        while length < max_length and data[candidate + length] == data[position + length]:
+            length += 1
+
+        if length > best_length:
+            best_length = length
+            best_offset = position - candidate
+            if length == max_length:
+                break
+
+        candidate = prev[candidate]
+        steps += 1
+
+    return best_length, best_offset
+
+
+def insert_position(data, position, head, prev):
+    if position + MIN_MATCH > len(data):
+        return
+
+    key = data[position] | (data[position + 1] << 8) | (data[position + 2] << 16)
+    prev[position] = head.get(key, -1)
+    head[key] = position
+
+
+def assemble_yakuza_stream(item_list) -> bytes:
+    compressed_bytes = bytearray()
+
+    flag_list = []
+    for group_start in range(0, len(item_list) + 1, 8):
+        flag = 0
+        for bit_index, item in enumerate(item_list[group_start:group_start + 8]):
+            if len(item) == 2:
+                flag |= 0x80 >> bit_index
+        flag_list.append(flag)
+
+    compressed_bytes.append(flag_list[0])
+    for item_index in range(len(item_list)):
+        # The next flag byte goes right before the data of the last item of a group
+        if item_index % 8 == 7:
+            compressed_bytes.append(flag_list[item_index // 8 + 1])
+        compressed_bytes += item_list[item_index]
+
+    return bytes(compressed_bytes)
+
+
+def yakuza(data: bytes, level: int = 6) -> bytes:
+    if level not in yakuza_levels:
+        raise ValueError("Compression level has to be between 1 and 9")
+
+    max_chain_steps, lazy_matching, insert_inside_match = yakuza_levels[level]
+
+    data = bytes(data)
+    data_size = len(data)
+
+    head = {}
+    prev = [-1] * data_size
+
+    # Literals are 1 byte long, back-references are 2 bytes long
+    item_list = []
+
+    position = 0
+    while position < data_size:
+        length, offset = find_longest_match(data, position, head, prev, max_chain_steps)
+        insert_position(data, position, head, prev)
+
+        if lazy_matching and MIN_MATCH <= length < MAX_MATCH:
+            next_length, next_offset = find_longest_match(data, position + 1, head, prev, max_chain_steps)
+
+            # A longer match starts at the next byte, so emit a literal first
+            if next_length > length:
+                item_list.append(data[position:position + 1])
+                position += 1
+                insert_position(data, position, head, prev)
+                length, offset = next_length, next_offset
+
+        if length >= MIN_MATCH:
+            item_list.append(bytes(((((offset - 1) & 0x0F) << 4) | (length - MIN_MATCH),
+                                    (offset - 1) >> 4)))
+            if insert_inside_match:
+                for match_position in range(position + 1, position + length):
+                    insert_position(data, match_position, head, prev)
+            position += length
+        else:
+            item_list.append(data[position:position + 1])
+            position += 1
+
+    return assemble_yakuza_stream(item_list)
+
+
+def benchmark_yakuza():
+    import random
+    from unyakuza import unyakuza, unyakuza_fast
+
+    # 256x256 VQ sub-texture: 256 2x2 tiles and 128*128 tile indexes
+    random.seed(0)
+    tile_bytes = bytes(random.getrandbits(8) for _ in range(2048))
+    # Stage textures reuse the same tiles in long stretches
+    index_bytes = bytes(((i // 128) // 8 + (i % 128) // 16) % 256 if random.random() < 0.8 else random.getrandbits(8)
+                        for i in range(128 * 128))
+    subtexture_bytes = tile_bytes + index_bytes
+
+    for level in yakuza_levels:
+        start_time = time.perf_counter()
+        compressed_bytes = yakuza(subtexture_bytes, level)
+        compression_time = time.perf_counter() - start_time
+
+        for decompressor in (unyakuza, unyakuza_fast):
+            uncompressed_bytes = decompressor(compressed_bytes, len(compressed_bytes), len(subtexture_bytes))
+            if bytes(uncompressed_bytes) != subtexture_bytes:
+                raise ValueError("Round trip through " + decompressor.__name__ + " failed at level " + str(level))
+
+        print("Level {}: {} -> {} bytes, {:.2f} MB/s".format(level,
+                                                             len(subtexture_bytes),
+                                                             len(compressed_bytes),
+                                                             len(subtexture_bytes) / compression_time / 1000000))
+
+
+if __name__ == "__main__":
+    benchmark_yakuza()